@@ -12,29 +12,50 @@ lookups from a terminal without any Gmail or Twilio credentials.
 from __future__ import annotations
 
 import argparse
+import atexit
 import base64
+import codecs
+import hashlib
+import importlib.util
 import json
 import logging
+import mmap
 import os
 import re
+import sqlite3
+import struct
+import sys
+import threading
+import unicodedata
 import urllib.parse
-from collections.abc import Callable
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache, wraps
+from bisect import bisect, bisect_left
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager, nullcontext, suppress
+from email.utils import parseaddr
+from functools import lru_cache, partial, wraps
+from html.parser import HTMLParser
 from pathlib import Path
-from time import sleep
-from typing import Any
+from time import monotonic, perf_counter, sleep, time
+from typing import TYPE_CHECKING, Any, Self, overload
 
-import requests
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+if TYPE_CHECKING:  # imported when first used, to keep start-up fast
+    from http.server import ThreadingHTTPServer
+
+    import requests
 
 logger = logging.getLogger("remotesearch")
 
 REQUEST_TIMEOUT = 10  # seconds, so a stuck target can't hang the poll loop
+DEFAULT_WORKERS = 4  # lookups answered at once; each mostly waits on the network
+LOOKUP_THREADS = 16  # shared by every in-flight source call in the process
 USER_AGENT = "RemoteSearch/2.0 (+https://github.com/SomethingObvious/remote-search-email-scraper)"
 DEFAULT_SMS_CHARS = 300  # ~2 GSM-7 segments
+MIN_SMS_CHARS = 10  # room for a word and "..."; any less and no reply fits
+MAX_SMS_BODY = 1600  # Twilio refuses longer message bodies
+MAX_QUERY_CHARS = 1000  # no texted question is longer; the rest of a body is skipped
+MAX_ANSWER_CHARS = 2000  # text kept from an HTML answer body, well past any reply
 
 # Keys read from config file and/or environment. Gmail needs the modify scope now
 # because the poller marks messages read so it never answers the same text twice.
@@ -42,8 +63,75 @@ GMAIL_KEYS = ("GMAIL_CREDENTIALS_FILE", "GMAIL_TOKEN_FILE", "GMAIL_SCOPE")
 # GMAIL_SCOPE has a default, so it isn't required; the credentials/token paths are.
 GMAIL_REQUIRED = ("GMAIL_CREDENTIALS_FILE", "GMAIL_TOKEN_FILE")
 TWILIO_KEYS = ("TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_FROM", "PHONE_TO")
+OPTIONAL_KEYS = (
+    "LABEL_NAME",
+    "POLL_INTERVAL",
+    "POLL_MAX_INTERVAL",
+    "WORKERS",
+    "MAX_SMS_CHARS",
+    "CACHE_FILE",
+    "CACHE_MAX_ENTRIES",
+    "SEARCH_SOURCES",
+    "SEARCH_DEADLINE",
+    "SEARCH_HEDGE",
+    "METRICS_PORT",
+    "METRICS_FILE",
+    "SMS_RATE",
+    "SMS_BURST",
+    "SMS_COALESCE",
+    "JOURNAL_FILE",
+    "TENANTS",
+    "SHARD",
+    "PLUGINS_DIR",
+    "CONTROL_SOCKET",
+    "HTTP_POOL_SIZE",
+    "HTTP_POOLS",
+    "DNS_TTL",
+    "QUERY_SIMILARITY",
+    "QUERY_ALIASES",
+    "WORDS_FILE",
+    "PREFETCH_BUDGET",
+    "KNOWLEDGE_INDEX",
+    "SMS_SEGMENTS",
+)
 DEFAULT_SCOPE = "https://www.googleapis.com/auth/gmail.modify"
 
+DEFAULT_CACHE_FILE = "cache.sqlite3"
+DEFAULT_JOURNAL_FILE = "journal.sqlite3"
+DEFAULT_CONTROL_SOCKET = "remotesearch.sock"
+DEFAULT_KNOWLEDGE_INDEX = "knowledge.idx"
+JOURNAL_KEEP = 7 * 86400  # seconds a finished message stays in the journal
+RESEND_EVERY = 300  # seconds between retries of replies whose send failed
+DEFAULT_CACHE_ENTRIES = 2048
+# How long a cached answer stays fresh, in seconds. Reference answers barely change;
+# weather is stale within the hour.
+TTL_REFERENCE = 30 * 86400
+TTL_SEARCH = 86400
+TTL_WEATHER = 20 * 60
+ASKED_KEEP = 7 * 86400  # forget queries nobody has asked for a week
+CACHE_FLUSH_EVERY = 30.0  # seconds between writes of the cache's ask counts and LRU touches
+
+# Gmail API cost per call, in quota units (developers.google.com/gmail/api/reference/quota).
+GMAIL_QUOTA_UNITS = {
+    "labels.list": 1,
+    "getProfile": 1,
+    "history.list": 2,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.batchModify": 50,
+}
+# Gmail allows 100 calls per batch but starts rate limiting well before that.
+FETCH_BATCH = 50
+LIST_PAGE = 500  # the most messages.list returns per page
+# Only what the poller reads: labels, headers and inline text bodies a few multipart
+# levels deep, not the snippet, sizes or attachment metadata.
+_PART = "mimeType,body/data"
+MESSAGE_FIELDS = (
+    f"id,labelIds,payload(headers,{_PART},parts({_PART},parts({_PART},parts({_PART}))))"
+)
+
+Source = Callable[[str], str | None]
+
 
 # --------------------------------------------------------------------------- #
 # Config
@@ -62,7 +150,7 @@ def load_config(path: str) -> dict[str, str]:
             if line and not line.startswith("#") and "=" in line:
                 key, value = line.split("=", 1)
                 config[key.strip()] = value.strip()
-    for key in (*GMAIL_KEYS, *TWILIO_KEYS, "LABEL_NAME", "POLL_INTERVAL", "MAX_SMS_CHARS"):
+    for key in (*GMAIL_KEYS, *TWILIO_KEYS, *OPTIONAL_KEYS):
         if os.environ.get(key):
             config[key] = os.environ[key]
     return config
@@ -75,64 +163,912 @@ def require(config: dict[str, str], keys: tuple[str, ...]) -> None:
         raise SystemExit(f"Missing required config: {', '.join(missing)} (see config.example.txt)")
 
 
+# --------------------------------------------------------------------------- #
+# Metrics
+# --------------------------------------------------------------------------- #
+class Histogram:
+    """Latency histogram over fixed buckets (seconds), cheap enough to update on every
+    message. Percentiles are read as the upper bound of the bucket they fall in."""
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile (0-1); inf if it's past
+        the last bucket, 0 with no samples."""
+        with self._lock:
+            rank, seen = q * self.count, 0
+            for bound, n in zip((*self.BUCKETS, float("inf")), self.counts, strict=True):
+                seen += n
+                if n and seen >= rank:
+                    return bound
+        return 0.0
+
+    def snapshot(self) -> tuple[list[int], int, float]:
+        """Bucket counts, sample count and sum, read consistently."""
+        with self._lock:
+            return list(self.counts), self.count, self.total
+
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _label_text(labels: Labels, *extra: tuple[str, str]) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    quoted = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, quoted, strict=True)) + "}"
+
+
+class Metrics:
+    """Process-wide counters, latency histograms and gauges, labelled Prometheus style,
+    so it's visible which source is slow or failing and how hard each stage works."""
+
+    def __init__(self) -> None:
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], Histogram] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            return self._histograms[key]
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        """Register a value that's read fresh each time metrics are rendered."""
+        self._gauges[name] = read
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counters(self, name: str) -> list[tuple[dict[str, str], float]]:
+        """Every labelled value of one counter."""
+        with self._lock:
+            return [(dict(labels), v) for (n, labels), v in self._counters.items() if n == name]
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines: list[str] = []
+        typed: set[str] = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_label_text(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            counts, count, total = histogram.snapshot()
+            cumulative = 0
+            for bound, n in zip((*Histogram.BUCKETS, "+Inf"), counts, strict=True):
+                cumulative += n
+                lines.append(f"{name}_bucket{_label_text(labels, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {total:g}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        for name, read in sorted(self._gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {read():g}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict[str, Any]:
+        """Everything as plain JSON-friendly data, with p50/p95/p99 per histogram."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        return {
+            "time": time(),
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.total,
+                    **{f"p{q}": histogram.percentile(q / 100) for q in (50, 95, 99)},
+                }
+                for (name, labels), histogram in histograms
+            ],
+            "gauges": {name: read() for name, read in sorted(self._gauges.items())},
+        }
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def timed(histogram: Histogram) -> Iterator[None]:
+    start = monotonic()
+    try:
+        yield
+    finally:
+        histogram.observe(monotonic() - start)
+
+
+class StartupProfile:
+    """Wall time of each start-up step, nested steps indented, for --profile-startup."""
+
+    def __init__(self) -> None:
+        self.steps: list[tuple[int, str, float]] = []  # (depth, name, seconds)
+        self._depth = 0
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        index = len(self.steps)
+        self.steps.append((self._depth, name, 0.0))
+        self._depth += 1
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.steps[index] = (self._depth, name, perf_counter() - start)
+
+    def report(self) -> str:
+        lines = [f"{'  ' * depth}{name:<{32 - 2 * depth}} {secs * 1000:8.1f} ms"
+                 for depth, name, secs in self.steps]  # fmt: skip
+        total = sum(secs for depth, _, secs in self.steps if depth == 0)
+        return "\n".join([*lines, f"{'total':<32} {total * 1000:8.1f} ms"])
+
+
+startup = StartupProfile()
+
+
 # --------------------------------------------------------------------------- #
 # HTTP
 # --------------------------------------------------------------------------- #
+# The upstreams every deployment talks to; each gets its own connection pool.
+UPSTREAM_HOSTS = (
+    "api.duckduckgo.com",
+    "en.wikipedia.org",
+    "wttr.in",
+    "api.stackexchange.com",
+    "api.dictionaryapi.dev",
+    "www.reddit.com",
+)
+# Enough keep-alive connections per host for every lookup thread to hold one, so a
+# burst never has to open (and then discard) extra connections.
+HTTP_POOL_SIZE = LOOKUP_THREADS
+DNS_TTL = 300.0  # seconds; upstream CDNs change addresses far less often
+
+pool_sizes: dict[str, int] = {}  # per-host overrides of HTTP_POOL_SIZE, from HTTP_POOLS
+
+
+class DnsCache:
+    """Each host's resolved addresses for ``ttl`` seconds, so opening a connection
+    to a known upstream doesn't wait on a DNS lookup. Once :meth:`install` ed it
+    answers ``socket.getaddrinfo`` for :attr:`hosts`; addresses that all fail to
+    connect are forgotten at once."""
+
+    def __init__(self, ttl: float = DNS_TTL) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.hosts: set[str] = set()
+        self._entries: dict[tuple[str, int, int], tuple[float, list[Any]]] = {}
+        self._lock = threading.Lock()
+        self._lookup: Any = None  # the real socket.getaddrinfo, once installed
+
+    def resolve(self, host: str, port: int, family: int = 0) -> list[Any]:
+        """``getaddrinfo`` results for a stream connection, every address in order."""
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port, family))
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        import socket
+
+        lookup = self._lookup or socket.getaddrinfo
+        addresses = lookup(host, port, family, socket.SOCK_STREAM)
+        with self._lock:
+            self._entries[(host, port, family)] = (now + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host: str, port: int) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[:2] == (host, port)]:
+                del self._entries[key]
+
+    def install(self) -> None:
+        """Wrap ``socket.getaddrinfo`` so stream lookups of :attr:`hosts` come from
+        the cache; every other lookup goes straight to the resolver, unchanged."""
+        import socket
+
+        with self._lock:
+            if self._lookup is not None:
+                return
+            self._lookup = lookup = socket.getaddrinfo
+
+        def getaddrinfo(
+            host: Any, port: Any, family: int = 0, type: int = 0, proto: int = 0, flags: int = 0
+        ) -> list[Any]:
+            if host in self.hosts and type == socket.SOCK_STREAM and not proto and not flags:
+                return self.resolve(host, port, family)
+            return lookup(host, port, family, type, proto, flags)
+
+        socket.getaddrinfo = getaddrinfo
+
+
+dns_cache = DnsCache()
+metrics.gauge("remotesearch_dns_cache_hits", lambda: dns_cache.hits)
+metrics.gauge("remotesearch_dns_cache_misses", lambda: dns_cache.misses)
+
+
+def configure_http(config: dict[str, str]) -> None:
+    """Apply HTTP_POOL_SIZE, HTTP_POOLS (``host:size,...``) and DNS_TTL, before the
+    first request builds the session."""
+    global HTTP_POOL_SIZE
+    HTTP_POOL_SIZE = int(config.get("HTTP_POOL_SIZE", HTTP_POOL_SIZE))
+    for item in config.get("HTTP_POOLS", "").split(","):
+        host, _, size = item.strip().rpartition(":")
+        if host and size.isdigit():
+            pool_sizes[host.lower()] = int(size)
+    dns_cache.ttl = float(config.get("DNS_TTL", dns_cache.ttl))
+    session.cache_clear()
+
+
+def connection_reuse() -> dict[str, float]:
+    """Per host, the share of requests sent on a kept-alive connection rather than a
+    new one: near 1.0 means keep-alive is working."""
+    opened = {
+        labels.get("host", ""): n
+        for labels, n in metrics.counters("remotesearch_http_connections_total")
+    }
+    return {
+        labels.get("host", ""): round(1 - opened.get(labels.get("host", ""), 0) / sent, 3)
+        for labels, sent in metrics.counters("remotesearch_http_sent_total")
+        if sent
+    }
+
+
+@lru_cache(maxsize=1)
+def host_adapter() -> type:
+    """requests' HTTPAdapter whose connections resolve through :data:`dns_cache` and
+    count new connections and requests per host, for :func:`connection_reuse`. Built
+    on first use, like :func:`counting_retry`."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import ConnectTimeoutError
+
+    dns_cache.install()
+
+    def tracked(base: Any) -> Any:
+        class Tracked(base):
+            def connect(self) -> None:
+                # Only the socket's addresses come from the cache; ``host`` stays the
+                # name, for the Host header and for TLS SNI and certificate checks.
+                host = self.host.strip("[]")
+                dns_cache.hosts.add(host)
+                try:
+                    super().connect()
+                except ConnectTimeoutError:  # also every NewConnectionError
+                    dns_cache.forget(host, self.port)
+                    raise
+                metrics.inc("remotesearch_http_connections_total", host=self.host)
+
+            def request(self, *args: Any, **kwargs: Any) -> None:
+                metrics.inc("remotesearch_http_sent_total", host=self.host)
+                super().request(*args, **kwargs)
+
+        return Tracked
+
+    class Pool(HTTPConnectionPool):
+        ConnectionCls = tracked(HTTPConnection)
+
+    class TlsPool(HTTPSConnectionPool):
+        ConnectionCls = tracked(HTTPSConnection)
+
+    class HostAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {"http": Pool, "https": TlsPool}
+
+    return HostAdapter
+
+
+@lru_cache(maxsize=1)
+def counting_retry() -> type:
+    """urllib3's Retry, counting each retry it grants per host in the metrics. Built on
+    first use, so a run that makes no HTTP requests never imports urllib3."""
+    from urllib3.util.retry import Retry
+
+    class CountingRetry(Retry):
+        def increment(
+            self,
+            method: str | None = None,
+            url: str | None = None,
+            response: Any = None,
+            error: Exception | None = None,
+            _pool: Any = None,
+            _stacktrace: Any = None,
+        ) -> Self:
+            metrics.inc("remotesearch_http_retries_total", host=getattr(_pool, "host", "unknown"))
+            return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    return CountingRetry
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, in bursts of up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float = 1) -> float:
+        """Seconds until ``n`` tokens are available (0 if they are now)."""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            refill = max(0.0, (n - self.tokens) / self.rate) if self.rate else float("inf")
+            return max(self.paused_until - now, refill, 0.0)
+
+    def try_take(self, n: float = 1, *, keep: float = 0) -> bool:
+        """Take ``n`` tokens if that still leaves ``keep`` in the bucket."""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            if now < self.paused_until or self.tokens - n < keep:
+                return False
+            self.tokens -= n
+            return True
+
+    def pause(self, seconds: float) -> None:
+        """Refuse everything for ``seconds``: the upstream said its quota is spent."""
+        with self._lock:
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """Stops calling a host that keeps failing.
+
+    After ``threshold`` failures in a row the circuit opens and every call is refused
+    for ``cooldown`` seconds. Then it's half-open: one probe goes through, and its
+    outcome closes the circuit again or reopens it for another cooldown.
+    """
+
+    def __init__(self, name: str, threshold: int = 3, cooldown: float = 60) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True  # exactly one probe per cooldown
+                return True
+            return False
+
+    def release(self) -> None:
+        """Give back a probe that :meth:`allow` granted but that was never sent."""
+        with self._lock:
+            self.probing = False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self.probing = False
+            if ok:
+                if self.opened_at is not None:
+                    logger.info("circuit for %s closed", self.name)
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning(
+                        "circuit for %s open after %d failures", self.name, self.failures
+                    )
+                self.opened_at = monotonic()
+
+    def trip(self, seconds: float) -> None:
+        """Open the circuit now, for ``seconds`` rather than the usual cooldown."""
+        with self._lock:
+            self.probing = False
+            self.opened_at = monotonic() - self.cooldown + seconds
+
+
+# Published anonymous limits: (requests, per seconds). Hosts not listed are unmetered.
+HOST_QUOTAS = {
+    "api.stackexchange.com": (300, 86400),  # 300 a day per IP without a key
+    "www.reddit.com": (10, 60),  # non-OAuth clients get about 10 a minute
+}
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60  # seconds
+THROTTLE_PAUSE = 300  # seconds to back off a 429 that doesn't say how long
+
+
+class Upstream:
+    """What get_json knows about one host: its circuit breaker and, if the host
+    publishes a limit, a token bucket tracking the quota left."""
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.breaker = CircuitBreaker(host, BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+        quota = HOST_QUOTAS.get(host)
+        self.bucket = TokenBucket(quota[0] / quota[1], quota[0]) if quota else None
+
+    def allow(self, spare: float = 0.0) -> bool:
+        """Whether to call the host now; False means skip it and answer without it.
+        ``spare`` is the share of the host's quota the call must leave untouched."""
+        if not self.breaker.allow():
+            return False
+        if self.bucket is not None and not self.bucket.try_take(keep=self.bucket.capacity * spare):
+            self.breaker.release()
+            return False
+        return True
+
+    def adapt(self, headers: Any, data: Any) -> None:
+        """Pause early when the host reports its quota is spent, before it starts
+        refusing us: Reddit's ``X-Ratelimit-*`` headers, Stack Exchange's
+        ``quota_remaining`` and ``backoff`` fields."""
+        remaining = headers.get("X-Ratelimit-Remaining")
+        if isinstance(data, dict) and "quota_remaining" in data:
+            remaining = data["quota_remaining"]
+        pause = 0.0
+        try:
+            if remaining is not None and float(remaining) < 1:
+                pause = float(headers.get("X-Ratelimit-Reset") or THROTTLE_PAUSE)
+            if isinstance(data, dict) and data.get("backoff"):
+                pause = max(pause, float(data["backoff"]))
+        except (TypeError, ValueError):
+            return
+        if pause:
+            logger.warning("%s quota spent, pausing it for %ds", self.host, pause)
+            if self.bucket is None:
+                self.bucket = TokenBucket(1, 1)
+            self.bucket.pause(pause)
+
+
+def _retry_after(headers: Any) -> float:
+    """Seconds from a ``Retry-After`` header; the HTTP-date form falls back to a default."""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return THROTTLE_PAUSE
+
+
+# Set on a thread doing lookups nobody is waiting for (the prefetcher's), so they
+# leave part of each metered host's quota for real texts.
+background = threading.local()
+PREFETCH_SPARE = 0.5
+
+_upstreams: dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(host: str) -> Upstream:
+    with _upstreams_lock:
+        if host not in _upstreams:
+            _upstreams[host] = Upstream(host)
+        return _upstreams[host]
+
+
 @lru_cache(maxsize=1)
 def session() -> requests.Session:
-    """One pooled session for the whole process: keep-alive plus retry on 429/5xx."""
+    """One pooled session for the whole process: keep-alive plus retry on 5xx.
+
+    Each upstream in :data:`UPSTREAM_HOSTS` has its own adapter and pool (sized by
+    HTTP_POOL_SIZE, or per host by HTTP_POOLS), so a burst to one host never evicts
+    another's warm connections; anything else shares a default pool.
+
+    A 429 isn't retried here: hammering a host that just throttled us only digs
+    deeper, so get_json pauses that host instead.
+    """
+    with startup.step("import requests"):
+        import requests
+
     sess = requests.Session()
-    retry = Retry(
+    retry = counting_retry()(
         total=2,
         backoff_factor=0.3,
-        status_forcelist=(429, 500, 502, 503, 504),
+        status_forcelist=(500, 502, 503, 504),
         allowed_methods=("GET",),
     )
-    adapter = HTTPAdapter(max_retries=retry, pool_connections=10, pool_maxsize=10)
-    sess.mount("https://", adapter)
-    sess.mount("http://", adapter)
+    adapter = host_adapter()
+    default = adapter(max_retries=retry, pool_connections=10, pool_maxsize=HTTP_POOL_SIZE)
+    sess.mount("https://", default)
+    sess.mount("http://", default)
+    for host in dict.fromkeys([*UPSTREAM_HOSTS, *pool_sizes]):
+        size = pool_sizes.get(host, HTTP_POOL_SIZE)
+        sess.mount(
+            f"https://{host}/", adapter(max_retries=retry, pool_connections=1, pool_maxsize=size)
+        )
     sess.headers.update({"User-Agent": USER_AGENT})
     return sess
 
 
 def get_json(url: str, **params: Any) -> Any:
-    """GET and parse JSON, or None on any network/HTTP/parse error (never raises)."""
+    """GET and parse JSON, or None on any network/HTTP/parse error (never raises).
+
+    A host whose circuit is open or whose quota is spent isn't called at all: None
+    comes back at once, so the reply falls through to another source right away.
+    """
+    host = urllib.parse.urlsplit(url).hostname or "unknown"
+    guard = upstream(host)
+    if not guard.allow(PREFETCH_SPARE if getattr(background, "on", False) else 0.0):
+        logger.debug("skipping %s: circuit open or quota spent", host)
+        metrics.inc("remotesearch_http_requests_total", host=host, outcome="skipped")
+        return None
+    resp = None
     try:
-        resp = session().get(url, params=params or None, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-        return resp.json()
-    except (requests.RequestException, ValueError) as exc:
+        with timed(metrics.histogram("remotesearch_http_request_seconds", host=host)):
+            resp = session().get(url, params=params or None, timeout=REQUEST_TIMEOUT)
+            resp.raise_for_status()
+            data = resp.json()
+    except (OSError, ValueError) as exc:  # RequestException is an OSError
         logger.warning("request failed: %s (%s)", url, exc)
+        metrics.inc("remotesearch_http_requests_total", host=host, outcome="error")
+        status = resp.status_code if resp is not None else None
+        if resp is not None and status == 429:
+            guard.breaker.trip(_retry_after(resp.headers))
+        else:
+            # A 404 for an unknown word is an answer, not an outage.
+            guard.breaker.record(status is not None and 400 <= status < 500)
         return None
+    guard.breaker.record(True)
+    guard.adapt(resp.headers, data)
+    metrics.inc("remotesearch_http_requests_total", host=host, outcome="ok")
+    return data
+
+
+class AnswerCache:
+    """Successful lookups, shared by every cached source.
 
+    Backed by SQLite so answers survive restarts and ``--once`` cron runs, and so
+    several processes pointed at the same file share one cache (WAL mode plus a busy
+    timeout keeps concurrent readers and writers safe). Each entry expires after its
+    source's TTL, and past ``max_entries`` the least recently used ones are evicted.
 
-def cache_answers(func: Callable[[str], str | None]) -> Callable[[str], str | None]:
+    Asks and LRU touches are buffered and written together at most every
+    ``flush_every`` seconds (or with the next :meth:`put`), so a hit stays a read.
+    """
+
+    def __init__(self, path: str = ":memory:", max_entries: int = DEFAULT_CACHE_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # one connection, shared by the worker threads
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (source TEXT NOT NULL, query TEXT NOT NULL, "
+            "value TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL, "
+            "PRIMARY KEY (source, query))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers (used)")
+        # What people ask, as typed, for the prefetcher to look up again.
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS asked (source TEXT NOT NULL, query TEXT NOT NULL, "
+            "text TEXT NOT NULL, count INTEGER NOT NULL, last REAL NOT NULL, "
+            "PRIMARY KEY (source, query))"
+        )
+        self.flush_every = CACHE_FLUSH_EVERY
+        self._asks: dict[tuple[str, str], tuple[str, int, float]] = {}  # text, count, last
+        self._uses: dict[tuple[str, str], float] = {}
+        self._flushed = monotonic()
+
+    def get(self, source: str, query: str) -> str | None:
+        """The fresh cached answer, or None. A hit counts as a use for LRU purposes."""
+        now = time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM answers WHERE source = ? AND query = ? AND expires > ?",
+                (source, query, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._uses[(source, query)] = now
+        self._flush_if_due()
+        return str(row[0])
+
+    def put(self, source: str, query: str, value: str, ttl: float) -> None:
+        """Store an answer, then drop expired entries and trim back to ``max_entries``."""
+        now = time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")  # take the write lock once for all of it
+            try:
+                self._write_pending()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                    (source, query, value, now + ttl, now),
+                )
+                self._db.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+                self._db.execute("DELETE FROM asked WHERE last <= ?", (now - ASKED_KEEP,))
+                (count,) = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()
+                if count > self.max_entries:
+                    self._db.execute(
+                        "DELETE FROM answers WHERE rowid IN "
+                        "(SELECT rowid FROM answers ORDER BY used LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+            self._written()
+
+    def asked(self, source: str, query: str, text: str) -> None:
+        """Count one more ask for ``query``, remembering the latest wording, ``text``."""
+        with self._lock:
+            _, count, _ = self._asks.get((source, query), ("", 0, 0.0))
+            self._asks[(source, query)] = (text, count + 1, time())
+        self._flush_if_due()
+
+    def flush(self) -> None:
+        """Write the buffered asks and LRU touches in one transaction. If the write
+        fails they stay buffered for the next try."""
+        with self._lock:
+            if not (self._asks or self._uses):
+                return
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_pending()
+                    self._db.execute("COMMIT")
+                except sqlite3.Error:
+                    self._db.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as exc:
+                logger.warning("cache bookkeeping write failed: %s", exc)
+                self._flushed = monotonic()  # not again until the next interval
+                return
+            self._written()
+
+    def _flush_if_due(self) -> None:
+        if monotonic() - self._flushed >= self.flush_every:
+            self.flush()
+
+    def _write_pending(self) -> None:
+        """Apply the buffered asks and touches; the caller holds the lock and has a
+        transaction open, and calls :meth:`_written` once it commits."""
+        self._db.executemany(
+            "INSERT INTO asked VALUES (?, ?, ?, ?, ?) ON CONFLICT (source, query) "
+            "DO UPDATE SET text = excluded.text, count = count + excluded.count, "
+            "last = excluded.last",
+            [(*key, *ask) for key, ask in self._asks.items()],
+        )
+        self._db.executemany(
+            "UPDATE answers SET used = ? WHERE source = ? AND query = ?",
+            [(used, *key) for key, used in self._uses.items()],
+        )
+
+    def _written(self) -> None:
+        self._asks.clear()
+        self._uses.clear()
+        self._flushed = monotonic()
+
+    def popular(
+        self, *, since: float, min_asks: int, expiring: float, limit: int
+    ) -> list[tuple[str, str]]:
+        """``(source, text)`` of queries asked at least ``min_asks`` times and last
+        since ``since``, whose answer is gone or expires before ``expiring``, most
+        asked first."""
+        self.flush()
+        with self._lock:
+            return self._db.execute(
+                "SELECT asked.source, asked.text FROM asked LEFT JOIN answers "
+                "ON answers.source = asked.source AND answers.query = asked.query "
+                "WHERE asked.last >= ? AND asked.count >= ? "
+                "AND (answers.expires IS NULL OR answers.expires < ?) "
+                "ORDER BY asked.count DESC, asked.last DESC LIMIT ?",
+                (since, min_asks, expiring, limit),
+            ).fetchall()
+
+    def peek(self, source: str, query: str) -> bool:
+        """Whether a fresh answer is cached, without counting a hit or a use."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM answers WHERE source = ? AND query = ? AND expires > ?",
+                (source, query, time()),
+            ).fetchone()
+        return row is not None
+
+    def queries(self) -> list[tuple[str, str]]:
+        """Every fresh ``(source, query)`` key."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT source, query FROM answers WHERE expires > ?", (time(),)
+            ).fetchall()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+# In-memory until main() points it at the configured file.
+answer_cache = AnswerCache()
+atexit.register(lambda: answer_cache.flush())  # a --once run's asks count too
+metrics.gauge("remotesearch_cache_hits", lambda: answer_cache.hits)
+metrics.gauge("remotesearch_cache_misses", lambda: answer_cache.misses)
+
+
+def configure_cache(path: str, max_entries: int = DEFAULT_CACHE_ENTRIES) -> AnswerCache:
+    """Swap the process-wide cache for one backed by ``path``."""
+    global answer_cache
+    answer_cache.flush()
+    answer_cache = AnswerCache(path, max_entries)
+    query_index.clear()
+    return answer_cache
+
+
+# Each cached source's uncached lookup-and-store, by source name, for the prefetcher.
+refreshers: dict[str, Callable[[str, str], str | None]] = {}
+
+
+@overload
+def cache_answers(func: Source, *, ttl: float = ..., near: bool = ...) -> Source: ...
+@overload
+def cache_answers(
+    func: None = None, *, ttl: float = ..., near: bool = ...
+) -> Callable[[Source], Source]: ...
+def cache_answers(
+    func: Source | None = None, *, ttl: float = TTL_SEARCH, near: bool = True
+) -> Source | Callable[[Source], Source]:
     """Memoize only successful lookups, so a transient failure or an empty result
-    isn't remembered as the permanent answer for that query."""
-    store: dict[str, str] = {}
-
-    @wraps(func)
-    def wrapper(query: str) -> str | None:
-        if query in store:
-            return store[query]
-        result = func(query)
-        if result:
-            if len(store) >= 512:  # bounded; SMS volume never gets close
-                store.clear()
-            store[query] = result
+    isn't remembered as the permanent answer for that query.
+
+    Use bare (``@cache_answers``) or with a TTL (``@cache_answers(ttl=600)``). Entries
+    are keyed by the source's name, so sources never see each other's answers, and by
+    :func:`query_key`, so the same query in another case or spacing shares one
+    entry. Failing an exact hit, a close enough earlier query (see
+    :class:`QueryIndex`) answers instead, unless ``near`` is False.
+    """
+
+    def decorate(func: Source) -> Source:
+        name = func.__name__
+
+        def refresh(query: str, key: str) -> str | None:
+            result = func(query)
+            if result:
+                try:
+                    answer_cache.put(name, key, result, ttl)
+                except sqlite3.Error as exc:  # a locked or full cache must not lose the answer
+                    logger.warning("cache write failed: %s", exc)
+                else:
+                    query_index.add(name, key)
+            return result
+
+        @wraps(func)
+        def wrapper(query: str) -> str | None:
+            key = query_key(query)
+            answer_cache.asked(name, key, query)
+            cached = answer_cache.get(name, key)
+            if cached is None and near and (other := query_index.nearest(name, key)):
+                cached = answer_cache.get(name, other)
+                if cached is not None:
+                    metrics.inc("remotesearch_cache_near_hits_total", source=name)
+            if cached is not None:
+                return cached
+            return refresh(query, key)
+
+        refreshers[name] = refresh
+        return wrapper
+
+    return decorate(func) if func else decorate
+
+
+def source_latency(name: str) -> Histogram:
+    """Call latency of one source, which the web search also uses to decide when to hedge."""
+    return metrics.histogram("remotesearch_source_seconds", source=name)
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one: the first caller runs
+    the lookup, and everyone who asks while it's in flight waits for and shares its
+    result, or its exception. Nothing is kept once the call finishes; that's the
+    answer cache's job."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: dict[tuple[str, str], Future[Any]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: tuple[str, str], func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = Future()
+        if not leader:
+            metrics.inc("remotesearch_source_calls_total", source=key[0], outcome="shared")
+            return call.result()
+        try:
+            result = func()
+        except BaseException as exc:
+            self._finish(key)
+            call.set_exception(exc)
+            raise
+        self._finish(key)
+        call.set_result(result)
         return result
 
-    return wrapper
+    def _finish(self, key: tuple[str, str]) -> None:
+        with self._lock:
+            del self._calls[key]
+
+
+in_flight = SingleFlight("sources")
 
 
-def run_source(source: Callable[[str], str | None], arg: str) -> str | None:
+def run_source(source: Source, arg: str, *, shared: bool = True) -> str | None:
     """Call a source, turning any unexpected error into None so a broken source
-    falls back to a web search instead of crashing the reply."""
+    falls back to a web search instead of crashing the reply.
+
+    Identical lookups already in flight (same source, same :func:`query_key`) share
+    that one call unless ``shared`` is off, as for a hedge.
+    """
+    name = getattr(source, "__name__", str(source))
+    if shared:
+        key = (name, query_key(arg))
+        result: str | None = in_flight.do(key, partial(run_source, source, arg, shared=False))
+        return result
     try:
-        return source(arg)
+        with timed(source_latency(name)):
+            result = source(arg)
     except Exception as exc:  # a bad source must never take down the reply
-        logger.warning("source %s failed: %s", getattr(source, "__name__", source), exc)
+        logger.warning("source %s failed: %s", name, exc)
+        metrics.inc("remotesearch_source_calls_total", source=name, outcome="error")
         return None
+    outcome = "answer" if result else "empty"
+    metrics.inc("remotesearch_source_calls_total", source=name, outcome=outcome)
+    return result
 
 
 # --------------------------------------------------------------------------- #
@@ -151,9 +1087,59 @@ def clean_query(text: str) -> str:
     return re.sub(r"\s+", " ", text).strip()
 
 
-def html_to_text(html: str) -> str:
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of HTML fed to it in pieces, and notes when it has
+    ``limit`` characters so the caller can stop feeding."""
+
+    SKIP = frozenset({"script", "style", "head", "title", "template"})
+
+    def __init__(self, limit: int) -> None:
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.size = 0
+        self.parts: list[str] = []
+        self._skipping = 0
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.limit
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:  # noqa: ARG002
+        if tag in self.SKIP:
+            self._skipping += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data: str) -> None:
+        if not self._skipping and not self.full and data.strip():
+            self.parts.append(data)
+            self.size += len(data)
+
+    def text(self) -> str:
+        return re.sub(r"\s+", " ", " ".join(self.parts)).strip()[: self.limit].rstrip()
+
+
+def html_text(html: str | Iterator[str], limit: int = MAX_QUERY_CHARS) -> str:
+    """The visible text of an HTML document (or of its pieces, as they're decoded),
+    whitespace collapsed, stopping once ``limit`` characters are in.
+
+    A streaming parse: no tree is built, and a big body is only read as far as needed.
+    """
+    extractor = _TextExtractor(limit)
+    for piece in [html] if isinstance(html, str) else html:
+        for start in range(0, len(piece), 8192):
+            extractor.feed(piece[start : start + 8192])
+            if extractor.full:
+                return extractor.text()
+    extractor.close()
+    return extractor.text()
+
+
+def html_to_text(html: str | Iterator[str]) -> str:
     """Flatten an HTML email body to a clean query string."""
-    return clean_query(BeautifulSoup(html, "html.parser").get_text(" "))
+    return clean_query(html_text(html))
 
 
 def strip_refs(text: str) -> str:
@@ -161,20 +1147,461 @@ def strip_refs(text: str) -> str:
     return re.sub(r"\[[A-Za-z0-9]+\]", "", text).strip()
 
 
-def truncate(text: str, limit: int) -> str:
-    """Trim to ``limit`` chars on a word boundary, GSM-7 safe (plain '...')."""
+def _prefix(text: str, limit: int, measure: Callable[[str], int] = len) -> str:
+    """The longest start of ``text`` that ``measure`` puts within ``limit``."""
+    if limit <= 0:
+        return ""
+    cut = text[:limit]  # every character measures at least 1
+    while cut and (excess := measure(cut) - limit) > 0:
+        cut = cut[:-excess]
+    return cut
+
+
+def truncate(text: str, limit: int, measure: Callable[[str], int] = len) -> str:
+    """Trim to ``limit`` chars (or units of ``measure``, like :func:`sms_units`) on a
+    word boundary, GSM-7 safe (plain '...')."""
     text = re.sub(r"\s+", " ", text).strip()
-    if len(text) <= limit:
+    if measure(text) <= limit:
         return text
-    cut = text[: limit - 3]
+    cut = _prefix(text, limit - 3, measure)
     if " " in cut:
         cut = cut.rsplit(" ", 1)[0]
     return cut.rstrip() + "..."
 
 
+# --------------------------------------------------------------------------- #
+# SMS encoding — Twilio bills by segment, and one character outside GSM-7 sends the
+# whole text as UCS-2, at less than half the characters per segment.
+# --------------------------------------------------------------------------- #
+GSM_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM_EXTENDED = "\f^{}\\[~]|€"  # sent as an escape plus a character: two septets each
+_NOT_GSM = re.compile(f"[^{re.escape(GSM_BASIC + GSM_EXTENDED)}]")
+_GSM_EXTENDED = re.compile(f"[{re.escape(GSM_EXTENDED)}]")
+# Common characters from web text with a GSM-7 stand-in that reads the same.
+GSM_LOOKALIKES = str.maketrans(
+    {
+        **dict.fromkeys("\u2018\u2019\u201a\u201b\u2032\u00b4`", "'"),  # quotes, primes
+        **dict.fromkeys("\u201c\u201d\u201e\u201f\u2033\u00ab\u00bb", '"'),
+        **dict.fromkeys("\u2010\u2011\u2012\u2013\u2014\u2015\u2212", "-"),  # dashes
+        **dict.fromkeys("\u00a0\u2002\u2003\u2007\u2009\u202f\t", " "),
+        **dict.fromkeys("\u200b\u200c\u200d\u00ad\ufeff°", ""),
+        "…": "...",
+        "•": "-",
+        "·": ".",
+        "\u00d7": "x",
+        "÷": "/",
+        "½": "1/2",
+        "¼": "1/4",
+        "©": "(c)",
+        "®": "(R)",
+        "™": "TM",
+    }
+)
+SMS_SEGMENT_SIZES = {"gsm7": (160, 153), "ucs2": (70, 67)}  # alone, per part when split
+
+
+@lru_cache(maxsize=4096)
+def _gsm_fold(char: str) -> str:
+    folded = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+    return folded if folded and not _NOT_GSM.search(folded) else char
+
+
+def to_gsm(text: str) -> str:
+    """``text`` with look-alikes swapped for GSM-7 characters and accents dropped
+    from letters GSM-7 doesn't have (``São`` becomes ``Sao``; ``é`` stays), so one
+    curly quote doesn't turn a whole reply into UCS-2. Characters with no stand-in
+    (CJK, emoji) are kept, and the reply goes as UCS-2."""
+    text = text.translate(GSM_LOOKALIKES)
+    if not _NOT_GSM.search(text):
+        return text
+    return _NOT_GSM.sub(lambda m: _gsm_fold(m[0]), text)
+
+
+def sms_encoding(text: str) -> str:
+    return "ucs2" if _NOT_GSM.search(text) else "gsm7"
+
+
+def _septets(text: str) -> int:
+    return len(text) + len(_GSM_EXTENDED.findall(text))
+
+
+def _utf16_units(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def sms_units(encoding: str) -> Callable[[str], int]:
+    """How long a text is in ``encoding``'s units: septets, or UTF-16 code units."""
+    return _septets if encoding == "gsm7" else _utf16_units
+
+
+def sms_capacity(segments: int, encoding: str = "gsm7") -> int:
+    """Units that fit in ``segments`` segments of ``encoding``."""
+    alone, part = SMS_SEGMENT_SIZES[encoding]
+    return alone if segments <= 1 else part * segments
+
+
+def check_limit(limit: int) -> int:
+    """``limit``, if a reply can be cut to that many characters; else ValueError."""
+    if not MIN_SMS_CHARS <= limit <= MAX_SMS_BODY:
+        raise ValueError(f"reply limit must be {MIN_SMS_CHARS}-{MAX_SMS_BODY} chars; got {limit}")
+    return limit
+
+
+def reply_limit(config: dict[str, str], max_chars: int | None = None) -> int:
+    """The reply limit: ``--max-chars``, else MAX_SMS_CHARS, else SMS_SEGMENTS worth of
+    GSM-7 characters, else the default. Exits on a limit no reply could fit."""
+    if config.get("MAX_SMS_CHARS") and config.get("SMS_SEGMENTS"):
+        logger.warning("MAX_SMS_CHARS is set, so SMS_SEGMENTS is ignored")
+    try:
+        if max_chars is not None:
+            limit = max_chars
+        elif config.get("MAX_SMS_CHARS"):
+            limit = int(config["MAX_SMS_CHARS"])
+        elif config.get("SMS_SEGMENTS"):
+            limit = sms_capacity(int(config["SMS_SEGMENTS"]))
+        else:
+            limit = DEFAULT_SMS_CHARS
+        return check_limit(limit)
+    except ValueError as exc:
+        raise SystemExit(f"Bad SMS length: {exc}") from None
+
+
+def sms_segments(text: str) -> tuple[str, int]:
+    """The encoding ``text`` goes out in and how many segments it's billed as."""
+    encoding = sms_encoding(text)
+    units = sms_units(encoding)(text)
+    alone, part = SMS_SEGMENT_SIZES[encoding]
+    return encoding, 1 if units <= alone else -(-units // part)
+
+
+def pack_reply(text: str, limit: int) -> tuple[str, int, Callable[[str], int]]:
+    """Prepare a reply for :func:`truncate` or :func:`paginate` under a ``limit``-char
+    budget: ``text`` in GSM-7 where possible, and the limit and measure that keep it
+    within the segments ``limit`` GSM-7 characters would take, whatever encoding
+    it ends up in."""
+    text = to_gsm(text)
+    encoding = sms_encoding(text)
+    return text, reply_budget(limit, encoding), sms_units(encoding)
+
+
+def reply_budget(limit: int, encoding: str) -> int:
+    """Units of ``encoding`` a ``limit``-char reply may take: at most ``limit``, in no
+    more segments than ``limit`` GSM-7 characters would."""
+    return min(limit, sms_capacity(sms_segments("x" * limit)[1], encoding))
+
+
+# --------------------------------------------------------------------------- #
+# Source registry — every command source, built in or plugged in.
+# --------------------------------------------------------------------------- #
+class SourceSpec:
+    """A command source and how to run it: the words that invoke it, the usage shown
+    by ``help``, how long its answers stay cached (None: not cached), how long a reply
+    waits on it before falling back to a web search (None: no limit beyond the HTTP
+    timeout), and its cost in upstream requests per lookup.
+
+    A plugin's spec starts out with only a ``loader``; its module isn't imported until
+    a text first uses the command.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Source | None = None,
+        *,
+        aliases: tuple[str, ...] = (),
+        usage: str = "",
+        ttl: float | None = None,
+        timeout: float | None = None,
+        cost: int = 1,
+        loader: Callable[[], Source | None] | None = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.aliases = aliases
+        self.usage = usage or f"{name} <query>"
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cost = cost
+        self.loader = loader
+
+    @property
+    def words(self) -> tuple[str, ...]:
+        return (self.name, *self.aliases)
+
+    def __repr__(self) -> str:
+        return f"SourceSpec({self.name!r}, aliases={self.aliases!r})"
+
+
+COMMANDS: dict[str, SourceSpec] = {}  # by name, in registration (and help) order
+PLUGIN_GROUP = "remotesearch.sources"  # entry point group for installed plugins
+
+
+def register_source(
+    name: str,
+    *,
+    aliases: tuple[str, ...] = (),
+    usage: str = "",
+    ttl: float | None = None,
+    timeout: float | None = None,
+    cost: int = 1,
+) -> Callable[[Source], Source]:
+    """Register the decorated function as the ``name`` command (and its ``aliases``),
+    cached for ``ttl`` seconds if given. Plugins use this too; a plugin registering
+    an existing name replaces it."""
+
+    def decorate(func: Source) -> Source:
+        if ttl is not None:
+            # A command names its subject exactly ("define horse" is not "define
+            # house"), so only exact rewordings share an entry.
+            func = cache_answers(func, ttl=ttl, near=False)
+        COMMANDS[name] = SourceSpec(
+            name, func, aliases=aliases, usage=usage, ttl=ttl, timeout=timeout, cost=cost
+        )
+        return func
+
+    return decorate
+
+
+def load_source(spec: SourceSpec) -> SourceSpec | None:
+    """Import a plugin's module on first use; None if it has no usable source."""
+    if spec.func is not None or spec.loader is None:
+        return spec if spec.func is not None else None
+    try:
+        func = spec.loader()
+    except Exception as exc:  # a broken plugin must not take down the reply
+        logger.error("plugin %s failed to load: %s", spec.name, exc)
+        func = None
+    spec.loader = None  # one attempt; a failure isn't retried on every text
+    loaded = COMMANDS.get(spec.name)
+    if loaded is not None and loaded is not spec:
+        return loaded  # the module registered itself, with its own settings
+    spec.func = func
+    return spec if func is not None else None
+
+
+def _load_plugin_file(path: Path) -> Source | None:
+    module_spec = importlib.util.spec_from_file_location(f"remotesearch_plugin_{path.stem}", path)
+    if module_spec is None or module_spec.loader is None:
+        return None
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return getattr(module, "lookup", None)
+
+
+def discover_plugins(directory: str | None = "plugins") -> list[str]:
+    """Register (without importing) each ``<command>.py`` in ``directory`` and every
+    installed ``remotesearch.sources`` entry point. Returns the new command names.
+    :func:`defer_plugins` puts this off until a text is first routed.
+
+    A plugin module either registers itself with :func:`register_source` under its
+    command name, or defines ``lookup(query) -> str | None``. Built-in commands keep
+    their names; a plugin can still replace one by registering it explicitly.
+    """
+    import importlib.metadata
+
+    found: dict[str, Callable[[], Source | None]] = {}
+    for entry in importlib.metadata.entry_points(group=PLUGIN_GROUP):
+        found[entry.name] = entry.load
+    folder = Path(directory) if directory else None
+    if folder and folder.is_dir():
+        for path in sorted(folder.glob("*.py")):
+            if not path.name.startswith("_"):
+                found[path.stem.lower()] = partial(_load_plugin_file, path)
+    added = [name for name in found if name not in COMMANDS]
+    for name in added:
+        COMMANDS[name] = SourceSpec(name, loader=found[name])
+    return added
+
+
+_undiscovered: list[str | None] = []  # plugin directories not scanned yet
+_discovery_lock = threading.Lock()
+
+
+def defer_plugins(directory: str | None) -> None:
+    """Discover plugins on the first routed text rather than now, so a cron run with
+    no mail never scans installed packages for entry points."""
+    with _discovery_lock:
+        _undiscovered.append(directory)
+
+
+# --------------------------------------------------------------------------- #
+# Offline knowledge index — dictionary and Wikipedia answers without the network
+# --------------------------------------------------------------------------- #
+KNOWLEDGE_MAGIC = b"RSKI\x00\x01\x00\x00"
+_KNOWLEDGE_HEADER = struct.Struct("<8sQQ")  # magic, entries, where the offset table starts
+_KNOWLEDGE_RECORD = struct.Struct("<HI")  # key length, value length; then key, value
+_KNOWLEDGE_OFFSET = struct.Struct("<Q")
+
+
+def knowledge_key(kind: str, title: str) -> bytes:
+    """``kind`` plus the title's case-folded words, as the index stores them."""
+    words = " ".join(re.findall(r"\w+", title.casefold()))
+    return f"{kind}\t{words}".encode()
+
+
+class KnowledgeIndex:
+    """A read-only, memory-mapped index of answers by kind (``define``, ``wiki``) and
+    title, built by :func:`build_knowledge_index`.
+
+    The file holds the records, then a table of their offsets sorted by key, so a
+    lookup is a binary search straight over the mapped file: a few microseconds,
+    touching only the couple of dozen pages on its path, however big the index is.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with Path(path).open("rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._table = _KNOWLEDGE_HEADER.unpack_from(self._map)
+        if magic != KNOWLEDGE_MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a knowledge index")
+
+    def _key(self, n: int) -> bytes:
+        (offset,) = _KNOWLEDGE_OFFSET.unpack_from(self._map, self._table + n * 8)
+        size, _ = _KNOWLEDGE_RECORD.unpack_from(self._map, offset)
+        start = offset + _KNOWLEDGE_RECORD.size
+        return self._map[start : start + size]
+
+    def get(self, kind: str, title: str) -> str | None:
+        key = knowledge_key(kind, title)
+        n = bisect_left(range(self.count), key, key=self._key)
+        if n == self.count or self._key(n) != key:
+            return None
+        (offset,) = _KNOWLEDGE_OFFSET.unpack_from(self._map, self._table + n * 8)
+        size, length = _KNOWLEDGE_RECORD.unpack_from(self._map, offset)
+        start = offset + _KNOWLEDGE_RECORD.size + size
+        return self._map[start : start + length].decode("utf-8")
+
+    def close(self) -> None:
+        self._map.close()
+
+
+knowledge: KnowledgeIndex | None = None
+
+
+def configure_knowledge(path: str) -> KnowledgeIndex | None:
+    """Answer from the index at ``path`` first, if there is one."""
+    global knowledge
+    try:
+        knowledge = KnowledgeIndex(path) if Path(path).exists() else None
+    except (OSError, ValueError) as exc:
+        logger.warning("knowledge index not used: %s", exc)
+        knowledge = None
+    return knowledge
+
+
+def knowledge_answer(kind: str, title: str) -> str | None:
+    """The offline answer for ``title``, or None to look it up online."""
+    if knowledge is None:
+        return None
+    found = knowledge.get(kind, title)
+    metrics.inc(
+        "remotesearch_knowledge_lookups_total", kind=kind, outcome="hit" if found else "miss"
+    )
+    return found
+
+
+def _open_dump(path: str) -> Any:
+    """A dump as text, decompressing ``.gz`` and ``.bz2`` as it's read."""
+    if path.endswith(".gz"):
+        import gzip
+
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        import bz2
+
+        return bz2.open(path, "rt", encoding="utf-8")
+    return Path(path).open(encoding="utf-8")
+
+
+def _dictionary_entries(path: str) -> Iterator[tuple[str, str, str]]:
+    """``("define", word, senses)`` from a Wiktionary JSONL extract (one entry per word
+    and part of speech, as kaikki.org publishes them), with up to two senses per
+    word like the online source."""
+    word, senses = "", list[str]()
+    with _open_dump(path) as lines:
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            glosses = [g for sense in entry.get("senses", []) for g in sense.get("glosses", [])]
+            gloss = entry.get("definition") or (glosses[0] if glosses else "")
+            if not entry.get("word") or not gloss:
+                continue
+            if entry["word"] != word:
+                if senses:
+                    yield "define", word, "; ".join(senses)
+                word, senses = entry["word"], []
+            if len(senses) < 2:
+                senses.append(f"({entry.get('pos', '')}) {gloss}".replace("() ", ""))
+    if senses:
+        yield "define", word, "; ".join(senses)
+
+
+def _abstract_entries(path: str) -> Iterator[tuple[str, str, str]]:
+    """``("wiki", title, abstract)`` from a Wikipedia abstracts dump
+    (``enwiki-*-abstract.xml``), parsed as a stream and discarded as it goes."""
+    from xml.etree.ElementTree import iterparse
+
+    with _open_dump(path) as xml:
+        root = None
+        # The dump is a local file from Wikimedia, not untrusted input.
+        for event, elem in iterparse(xml, events=("start", "end")):  # noqa: S314
+            if root is None:
+                root = elem
+            if event == "end" and elem.tag == "doc":
+                title = (elem.findtext("title") or "").removeprefix("Wikipedia: ")
+                abstract = strip_refs(elem.findtext("abstract") or "")
+                if title and abstract:
+                    yield "wiki", title, abstract
+                root.clear()  # keep memory flat however long the dump is
+
+
+def build_knowledge_index(path: str, dumps: list[str]) -> int:
+    """Stream dictionary (``.jsonl``) and Wikipedia abstract (``.xml``) dumps, either
+    optionally compressed, into a :class:`KnowledgeIndex` at ``path``; returns the
+    number of entries. The first entry for a title wins.
+
+    Records are written as they stream in; only the keys go through a temporary
+    on-disk SQLite table to be sorted, so memory stays flat for any dump size. The
+    new index replaces the old one atomically, so a running process keeps its map.
+    """
+    partial_path = Path(f"{path}.partial")
+    keys = sqlite3.connect("")  # a private temporary database on disk
+    keys.execute("CREATE TABLE keys (key BLOB PRIMARY KEY, offset INTEGER NOT NULL)")
+    count = 0
+    with partial_path.open("wb") as out:
+        out.write(_KNOWLEDGE_HEADER.pack(KNOWLEDGE_MAGIC, 0, 0))
+        for dump in dumps:
+            entries = _abstract_entries(dump) if ".xml" in dump else _dictionary_entries(dump)
+            for kind, title, answer in entries:
+                key = knowledge_key(kind, title)
+                value = answer[:MAX_ANSWER_CHARS].encode("utf-8")
+                if len(key) > 0xFFFF:
+                    continue
+                added = keys.execute("INSERT OR IGNORE INTO keys VALUES (?, ?)", (key, out.tell()))
+                if added.rowcount:
+                    out.write(_KNOWLEDGE_RECORD.pack(len(key), len(value)) + key + value)
+        table = out.tell()
+        for (offset,) in keys.execute("SELECT offset FROM keys ORDER BY key"):
+            out.write(_KNOWLEDGE_OFFSET.pack(offset))
+            count += 1
+        out.seek(0)
+        out.write(_KNOWLEDGE_HEADER.pack(KNOWLEDGE_MAGIC, count, table))
+    keys.close()
+    partial_path.replace(path)
+    return count
+
+
 # --------------------------------------------------------------------------- #
 # Sources — each returns a short answer string, or None if it has nothing.
-# Reference lookups (stable answers) are cached; time-sensitive ones are not.
+# Reference lookups are cached for weeks, weather for minutes; the community
+# sources (Reddit, Stack Overflow) are not cached.
 # --------------------------------------------------------------------------- #
 @cache_answers
 def source_duckduckgo(query: str) -> str | None:
@@ -198,9 +1625,13 @@ def source_duckduckgo(query: str) -> str | None:
     return None
 
 
-@cache_answers
+@register_source("wiki", usage="wiki <topic>", ttl=TTL_REFERENCE)
 def source_wikipedia(query: str) -> str | None:
-    """Top Wikipedia hit's lead summary via the official search + REST APIs."""
+    """Top Wikipedia hit's lead summary via the official search + REST APIs, or
+    straight from the offline index when it has the exact title."""
+    known = knowledge_answer("wiki", query)
+    if known:
+        return known
     hits = get_json(
         "https://en.wikipedia.org/w/api.php",
         action="query",
@@ -218,9 +1649,12 @@ def source_wikipedia(query: str) -> str | None:
     return strip_refs(extract) if extract else None
 
 
-@cache_answers
+@register_source("define", aliases=("def", "dict"), usage="define <word>", ttl=TTL_REFERENCE)
 def source_dictionary(word: str) -> str | None:
-    """First one or two senses from the free Dictionary API."""
+    """First one or two senses from the free Dictionary API, or the offline index."""
+    known = knowledge_answer("define", word)
+    if known:
+        return known
     entries = get_json(
         f"https://api.dictionaryapi.dev/api/v2/entries/en/{urllib.parse.quote(word)}"
     )
@@ -235,6 +1669,7 @@ def source_dictionary(word: str) -> str | None:
     return "; ".join(senses) or None
 
 
+@register_source("weather", usage="weather <place>", ttl=TTL_WEATHER)
 def source_weather(place: str) -> str | None:
     """Current conditions from wttr.in, formatted plain for SMS (no emoji/degree)."""
     data = get_json(f"https://wttr.in/{urllib.parse.quote(place)}", format="j1")
@@ -250,6 +1685,7 @@ def source_weather(place: str) -> str | None:
     )
 
 
+@register_source("reddit", aliases=("r",), timeout=5.0)
 def source_reddit(query: str) -> str | None:
     """Top Reddit search hit. Best effort: Reddit throttles non-OAuth clients, so
     a block just returns None and the caller falls back to a plain web search."""
@@ -266,6 +1702,7 @@ def source_reddit(query: str) -> str | None:
     return f"{title} ({sub}): {body}".strip(" :") or None
 
 
+@register_source("so", aliases=("stack", "stackoverflow"), timeout=5.0, cost=2)
 def source_stackoverflow(query: str) -> str | None:
     """Top Stack Overflow question plus its highest-voted answer body."""
     found = get_json(
@@ -295,75 +1732,758 @@ def source_stackoverflow(query: str) -> str | None:
     body_items = (answers or {}).get("items", [])
     if not body_items:
         return f"{title} (no answers yet)"
-    body = BeautifulSoup(body_items[0].get("body", ""), "html.parser").get_text(" ", strip=True)
+    body = html_text(body_items[0].get("body", ""), MAX_ANSWER_CHARS)
     return f"{title} - {body}"
 
 
-ROUTES: dict[str, Callable[[str], str | None]] = {
-    "weather": source_weather,
-    "define": source_dictionary,
-    "def": source_dictionary,
-    "dict": source_dictionary,
-    "wiki": source_wikipedia,
-    "reddit": source_reddit,
-    "r": source_reddit,
-    "so": source_stackoverflow,
-    "stack": source_stackoverflow,
-    "stackoverflow": source_stackoverflow,
+# --------------------------------------------------------------------------- #
+# Command router
+# --------------------------------------------------------------------------- #
+T9_KEYS = str.maketrans("abcdefghijklmnopqrstuvwxyz", "22233344455566677778889999")
+MIN_PREFIX = 4  # "weat" means weather, but "red wine" is not a Reddit search
+MIN_FUZZY = 5  # only long words are matched one typo away
+# Command words need one more letter: one typo from "stack" is "stock" or "snack".
+MIN_FUZZY_COMMAND = 6
+
+
+class _TrieNode:
+    __slots__ = ("children", "names")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _TrieNode] = {}
+        self.names: set[str] = set()  # every command with a word below this node
+
+
+def _one_typo(word: str, target: str) -> bool:
+    """Exactly one insertion, deletion, substitution or swap of neighbours apart."""
+    if word == target or abs(len(word) - len(target)) > 1:
+        return False
+    if len(word) == len(target):
+        diffs = [i for i, (a, b) in enumerate(zip(word, target, strict=True)) if a != b]
+        return len(diffs) == 1 or (
+            len(diffs) == 2
+            and diffs[1] == diffs[0] + 1
+            and word[diffs[0]] == target[diffs[1]]
+            and word[diffs[1]] == target[diffs[0]]
+        )
+    short, long = sorted((word, target), key=len)
+    return any(long[:i] + long[i + 1 :] == short for i in range(len(long)))
+
+
+class CommandIndex:
+    """Every command word compiled for fast, forgiving lookup of a text's first word:
+    exact words, unambiguous prefixes (``weat``), one typo on a long word
+    (``wether``), and T9 keypad digits (``9454``). A real word typed on the same
+    keys (``snack`` for ``stack``) is left alone: it's far likelier meant as typed."""
+
+    def __init__(self, specs: list[SourceSpec]) -> None:
+        self.exact: dict[str, SourceSpec] = {}
+        self.trie = _TrieNode()
+        self.t9: dict[str, set[str]] = {}
+        self.specs = {spec.name: spec for spec in specs}
+        for spec in specs:
+            for word in spec.words:
+                self.exact[word] = spec
+                node = self.trie
+                for char in word:
+                    node = node.children.setdefault(char, _TrieNode())
+                    node.names.add(spec.name)
+                if len(word) >= MIN_PREFIX:
+                    self.t9.setdefault(word.translate(T9_KEYS), set()).add(spec.name)
+
+    def _unique(self, names: set[str]) -> SourceSpec | None:
+        return self.specs[next(iter(names))] if len(names) == 1 else None
+
+    def match(self, word: str, *, t9: bool = True) -> SourceSpec | None:
+        """The command ``word`` most plausibly means, or None if it's not one (or it
+        could be more than one). With ``t9`` False, digits are only ever a number."""
+        if word in self.exact:
+            return self.exact[word]
+        if len(word) >= MIN_PREFIX:
+            node: _TrieNode | None = self.trie
+            for char in word:
+                node = node.children.get(char) if node else None
+            if node and (spec := self._unique(node.names)):
+                return spec
+        if t9 and word.isdigit() and (spec := self._unique(self.t9.get(word, set()))):
+            return spec
+        if len(word) >= MIN_FUZZY_COMMAND - 1:
+            return self._unique(
+                {
+                    name
+                    for name, spec in self.specs.items()
+                    for target in spec.words
+                    if len(target) >= MIN_FUZZY_COMMAND
+                    and target[0] == word[0]
+                    and _one_typo(word, target)
+                }
+            )
+        return None
+
+
+def command_index() -> CommandIndex:
+    """The index over every registered command, compiled once per set of commands."""
+    if _undiscovered:
+        with _discovery_lock:
+            while _undiscovered:
+                discover_plugins(_undiscovered.pop(0))
+    return _compile_index(tuple(COMMANDS.values()))
+
+
+@lru_cache(maxsize=4)
+def _compile_index(specs: tuple[SourceSpec, ...]) -> CommandIndex:
+    return CommandIndex(list(specs))
+
+
+# --------------------------------------------------------------------------- #
+# Query keys
+# --------------------------------------------------------------------------- #
+_STOPWORDS = (
+    "a an the is are was were be of to in on at for from by with and or "
+    "please me my i you can could tell give show about"
+)
+STOPWORDS = frozenset(_STOPWORDS.split())
+# Short names people text for places, spelled out so near matching sees both as one.
+PLACE_ALIASES = {
+    "nyc": "new york",
+    "la": "los angeles",
+    "sf": "san francisco",
+    "dc": "washington",
+    "philly": "philadelphia",
+    "vegas": "las vegas",
+    "yvr": "vancouver",
+    "yyz": "toronto",
+    "yul": "montreal",
+    "yyc": "calgary",
 }
+QUERY_SIMILARITY = 0.8  # share of words two queries must have in common to share an answer
+WORDS_FILE = "/usr/share/dict/words"  # real words, which are never "corrected" into others
+
+
+def query_key(query: str) -> str:
+    """The cache key for a query: case-folded, whitespace collapsed, and nothing else,
+    so ``Weather  Toronto`` and ``weather toronto`` share an entry but ``10 - 3`` and
+    ``3 - 10``, or ``dog bites man`` and ``man bites dog``, never do."""
+    return " ".join(query.casefold().split())
+
+
+def query_words(query: str) -> list[str]:
+    """The words :class:`QueryIndex` compares, in order: no punctuation (but operators
+    are words) or stopwords, place aliases spelled out, each word once."""
+    words: list[str] = []
+    for word in re.findall(r"[\w+#]+|[-*/^%=<>]", query.casefold()):
+        words.extend(PLACE_ALIASES.get(word, word).split())
+    kept = [word for word in words if word not in STOPWORDS] or words  # "to be or"
+    return list(dict.fromkeys(kept))
+
+
+class QueryIndex:
+    """An inverted index from each word to the cached query keys holding it, per
+    source, for serving near-duplicate questions from the cache.
+
+    :meth:`nearest` finds the earlier key sharing the most :func:`query_words` with a
+    new one (by Jaccard similarity, at least ``threshold``), in the same order, so
+    ``flights toronto to vancouver`` never answers ``flights vancouver to toronto``.
+    Words are compared after correcting T9 digits and
+    misspellings that are one typo, or the same T9 keys, away from exactly one known
+    word. A dictionary word is never corrected: "horse" is not a typo of "house",
+    nor "home" of "good". Without a dictionary (``words_file`` or the offline
+    index's definitions), only digits are. Corrections only steer that search;
+    answers are always stored under the key as typed. Seeded from the answer cache
+    on first use, so it survives restarts with it.
+    """
+
+    def __init__(self, threshold: float = QUERY_SIMILARITY, words_file: str = WORDS_FILE) -> None:
+        self.threshold = threshold
+        self.words_file = words_file
+        self._words: frozenset[str] = frozenset()
+        self._postings: dict[tuple[str, str], set[str]] = {}
+        self._t9: dict[str, set[str]] = {}
+        self._seeded = False
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._t9.clear()
+            self._words = frozenset()
+            self._seeded = False
+
+    def add(self, source: str, key: str) -> None:
+        with self._lock:
+            self._add(source, key)
+
+    def _add(self, source: str, key: str) -> None:
+        for word in query_words(key):
+            self._postings.setdefault((source, word), set()).add(key)
+            self._t9.setdefault(word.translate(T9_KEYS), set()).add(word)
+
+    def _seed(self) -> None:
+        if not self._seeded:
+            self._seeded = True
+            for source, key in answer_cache.queries():
+                self._add(source, key)
+            try:
+                text = Path(self.words_file).read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                text = ""
+            self._words = frozenset(text.casefold().split())
+
+    def correct(self, word: str) -> str:
+        """``word``, or the one known word it was most likely meant to be."""
+        with self._lock:
+            self._seed()
+            return self._correct(word)
+
+    def _misspelt(self, word: str) -> bool:
+        """Whether ``word`` is letters but no dictionary word; False with no dictionary."""
+        if not word.isalpha() or word in self._words:
+            return False
+        if knowledge is not None:
+            return knowledge.get("define", word) is None
+        return bool(self._words)
+
+    def _correct(self, word: str) -> str:
+        keys = word.translate(T9_KEYS)
+        if keys in self._t9 and word in self._t9[keys]:
+            return word
+        if not (word.isdigit() or self._misspelt(word)):
+            return word
+        matches = {other for other in self._t9.get(keys, ()) if other != word}
+        if len(word) >= MIN_FUZZY:
+            matches |= {
+                known
+                for group in self._t9.values()
+                for known in group
+                if known[0] == word[0] and _one_typo(word, known)
+            }
+        return next(iter(matches)) if len(matches) == 1 else word
+
+    def nearest(self, source: str, key: str) -> str | None:
+        """The most similar other cached key for ``source``, or None if none is close.
+        A one-word key never matches another: it has no other words to agree on."""
+        words = query_words(key)
+        if self.threshold >= 1 or len(words) < 2:
+            return None
+        with self._lock:
+            self._seed()
+            words = list(dict.fromkeys(self._correct(word) for word in words))
+            shared: dict[str, int] = {}
+            for word in words:
+                for other in self._postings.get((source, word), ()):
+                    shared[other] = shared.get(other, 0) + 1
+        best, score = None, self.threshold
+        for other, common in shared.items():
+            other_words = query_words(other)
+            similarity = common / (len(words) + len(other_words) - common)
+            if other != key and similarity >= score and _same_order(words, other_words):
+                best, score = other, similarity
+        return best
+
+
+def _same_order(words: list[str], other: list[str]) -> bool:
+    """Whether the words two queries share come in the same order in both."""
+    common = set(words) & set(other)
+    return [w for w in words if w in common] == [w for w in other if w in common]
+
+
+query_index = QueryIndex()
+
+
+def configure_queries(config: dict[str, str]) -> None:
+    """Apply QUERY_SIMILARITY (1 turns near matching off), WORDS_FILE and
+    QUERY_ALIASES, extra ``short=long name`` pairs for :data:`PLACE_ALIASES`."""
+    query_index.threshold = float(config.get("QUERY_SIMILARITY", query_index.threshold))
+    query_index.words_file = config.get("WORDS_FILE", query_index.words_file)
+    query_index.clear()
+    for item in config.get("QUERY_ALIASES", "").split(","):
+        short, _, name = item.partition("=")
+        if short.strip() and name.strip():
+            PLACE_ALIASES[short.strip().casefold()] = name.strip().casefold()
+
+
+def help_text() -> str:
+    command_index()  # so plugins not yet discovered list their commands too
+    usages = ", ".join(spec.usage for spec in COMMANDS.values())
+    return f"Commands: {usages}, more, help. Anything else runs a web search."
+
+
 HELP_WORDS = {"help", "?", "commands"}
-HELP_TEXT = (
-    "Commands: weather <place>, define <word>, wiki <topic>, reddit <query>, "
-    "so <query>, help. Anything else runs a web search."
+EMPTY_REPLY = "Empty message. Text 'help' for commands."
+HELP_TEXT = help_text()  # the built-in commands; plugins add theirs to the live reply
+
+
+@lru_cache(maxsize=1)
+def lookup_pool() -> ThreadPoolExecutor:
+    """One pool of lookup threads for the whole process, shared by the web-search
+    fan-out and the async API, instead of a fresh pool per query."""
+    return ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix="lookup")
+
+
+SEARCH_SOURCES: dict[str, Source] = {
+    "duckduckgo": source_duckduckgo,
+    "wikipedia": source_wikipedia,
+}
+HEDGE_MIN_SAMPLES = 20  # a source's p95 means little before this many calls
+
+
+class SearchPolicy:
+    """How the plain web search fans out: which sources, in what priority, how long a
+    reply may wait for a better answer, and whether to hedge slow sources."""
+
+    def __init__(
+        self,
+        order: tuple[str, ...] = ("duckduckgo", "wikipedia"),
+        deadline: float = 1.5,
+        hedge: bool = False,
+    ) -> None:
+        unknown = [name for name in order if name not in SEARCH_SOURCES]
+        if unknown or not order:
+            raise SystemExit(
+                f"SEARCH_SOURCES must list some of {', '.join(SEARCH_SOURCES)}; "
+                f"got {', '.join(order) or 'nothing'}"
+            )
+        self.order = order
+        self.deadline = deadline
+        self.hedge = hedge
+
+    @classmethod
+    def from_config(cls, config: dict[str, str]) -> SearchPolicy:
+        default = cls()
+        order = config.get("SEARCH_SOURCES")
+        return cls(
+            tuple(n.strip().lower() for n in order.split(",") if n.strip())
+            if order
+            else default.order,
+            float(config.get("SEARCH_DEADLINE", default.deadline)),
+            config.get("SEARCH_HEDGE", "").lower() in {"1", "true", "yes", "on"},
+        )
+
+
+search_policy = SearchPolicy()
+
+
+def configure_search(config: dict[str, str]) -> SearchPolicy:
+    """Swap the process-wide search policy for the configured one."""
+    global search_policy
+    search_policy = SearchPolicy.from_config(config)
+    return search_policy
+
+
+def _settled(results: dict[int, str | None], ranks: int) -> tuple[bool, str | None]:
+    """Whether the race is decided: the best-ranked answer is in and every source
+    ranked above it has come up empty."""
+    for rank in range(ranks):
+        if rank not in results:
+            return False, None
+        if results[rank]:
+            return True, results[rank]
+    return True, None
+
+
+def default_search(query: str, policy: SearchPolicy | None = None) -> str | None:
+    """Race the web-search sources and return the best answer ready by the deadline.
+
+    Every source starts at once. The top-priority answer wins as soon as every source
+    ranked above it has come up empty, so a fast DuckDuckGo hit returns immediately
+    and a DuckDuckGo miss doesn't wait for a retry. At the deadline the best answer
+    already in wins, and stragglers finish in the background (their answers still
+    land in the cache). With nothing in by then, the first answer to arrive wins.
+    With hedging on, a source still running past its usual p95 gets a second,
+    duplicate request, and whichever copy finishes first counts.
+    """
+    policy = policy or search_policy
+    sources = [SEARCH_SOURCES[name] for name in policy.order]
+    pool = lookup_pool()
+    start = monotonic()
+    deadline = start + policy.deadline
+    running = {pool.submit(run_source, src, query): rank for rank, src in enumerate(sources)}
+    hedge_at: dict[int, float] = {}
+    if policy.hedge:
+        for rank, name in enumerate(policy.order):
+            latency = source_latency(SEARCH_SOURCES[name].__name__)
+            if latency.count >= HEDGE_MIN_SAMPLES and latency.percentile(0.95) < policy.deadline:
+                hedge_at[rank] = start + latency.percentile(0.95)
+    results: dict[int, str | None] = {}
+    while running:
+        now = monotonic()
+        for rank, when in list(hedge_at.items()):
+            if now >= when:
+                del hedge_at[rank]
+                if rank not in results:
+                    # A hedge must really go upstream again, not join the slow call.
+                    running[pool.submit(run_source, sources[rank], query, shared=False)] = rank
+        # Wake for the next hedge or the deadline; past it, wait for the next source.
+        wakes = [*hedge_at.values(), *([deadline] if now < deadline else [])]
+        timeout = max(0.0, min(wakes) - now) if wakes else None
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            rank = running.pop(future)
+            if not results.get(rank):  # a hedged copy can't overwrite a real answer
+                results[rank] = future.result()
+        settled, best = _settled(results, len(sources))
+        if settled:
+            return best
+        if monotonic() >= deadline:
+            answered = [results[r] for r in sorted(results) if results[r]]
+            if answered:
+                return answered[0]
+    return None
+
+
+# After a number, these make it a sum or a quantity ("3428 divided by 4", "9454 km in
+# miles"), not a command typed as keypad digits.
+_QUANTITY = re.compile(
+    r"\s*(?:[-+*/^%=\u00d7\u00b0]|(?:x|divided|times|plus|minus|over|mod|squared|cubed|"
+    r"percent|km|kms|m|cm|mm|mi|miles?|ft|feet|inch(?:es)?|yards?|kg|g|lbs?|pounds?|oz|"
+    r"ounces?|l|ml|litres?|liters?|gallons?|kilo\w*|centi\w*|milli\w*|meters?|metres?|"
+    r"degrees?|c|f|celsius|fahrenheit|usd|cad|eur|gbp|dollars?|euros?|mph|kph|kmh|"
+    r"seconds?|secs?|minutes?|mins?|hours?|hrs?|days?|weeks?|months?|years?|bytes?|"
+    r"kb|mb|gb|tb)\b)",
+    re.IGNORECASE,
 )
 
 
-def default_search(query: str) -> str | None:
-    """Query DuckDuckGo and Wikipedia at the same time; prefer DuckDuckGo."""
-    with ThreadPoolExecutor(max_workers=2) as pool:
-        ddg = pool.submit(run_source, source_duckduckgo, query)
-        wiki = pool.submit(run_source, source_wikipedia, query)
-        return ddg.result() or wiki.result()
+def route(query: str) -> tuple[str, SourceSpec | None, str]:
+    """Split a text into its command, that command's source, and the text to look up.
+    The source is None for a plain web search (including a bare command word)."""
+    command, _, rest = query.partition(" ")
+    key = command.lower().strip(":,")
+    t9 = not _QUANTITY.match(rest)
+    spec = command_index().match(key, t9=t9) if rest.strip() else None
+    if spec is not None:
+        spec = load_source(spec)
+    if spec is not None:
+        return spec.name, spec, rest.strip()
+    return key, None, query
+
+
+def run_command(spec: SourceSpec, arg: str) -> str | None:
+    """:func:`run_source` for a command, giving up after the command's timeout."""
+    assert spec.func is not None  # route() only returns loaded sources
+    if spec.timeout is None:
+        return run_source(spec.func, arg)
+    future = lookup_pool().submit(run_source, spec.func, arg)
+    try:
+        return future.result(timeout=spec.timeout)
+    except TimeoutError:
+        logger.warning("%s took over %ss; falling back to a web search", spec.name, spec.timeout)
+        metrics.inc("remotesearch_source_calls_total", source=spec.name, outcome="timeout")
+        return None
+
+
+MORE_HINT = " (more)"
+MORE_COMMAND = re.compile(r"more(?:\s+(\d{1,2}))?", re.IGNORECASE)
+NO_MORE_REPLY = "Nothing more to send. Text a new question."
+MAX_PAGES = 10  # of one reply; a longer one ends truncated on the last
+PAGE_TTL = 3600  # seconds a reply's remaining parts stay available
+PAGE_SESSIONS = 1024  # recipients whose parts are kept; the longest idle go first
 
 
-def answer(query: str, limit: int = DEFAULT_SMS_CHARS) -> str:
+def paginate(
+    text: str, limit: int, max_pages: int = MAX_PAGES, measure: Callable[[str], int] = len
+) -> list[str]:
+    """Split a reply into SMS-sized parts on word boundaries: the first reads like
+    a plain reply ending in ``(more)``, the rest are numbered ``(2/3) ...``."""
+    text = re.sub(r"\s+", " ", text).strip()
+    room = limit - len(MORE_HINT) - len(f"({max_pages}/{max_pages}) ")
+    if measure(text) <= limit or room < 20:
+        return [truncate(text, limit, measure)]
+    chunks: list[str] = []
+    while text and len(chunks) < max_pages:
+        cut = _prefix(text, room, measure)
+        if len(cut) < len(text) and " " in cut:
+            cut = cut.rsplit(" ", 1)[0]
+        chunks.append(cut.rstrip())
+        text = text[len(cut) :].lstrip()
+    if text:
+        chunks[-1] = truncate(f"{chunks[-1]} {text}", room, measure)
+    n = len(chunks)
+    return [
+        (f"({i}/{n}) " if i > 1 else "") + chunk + (MORE_HINT if i < n else "")
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+class _Paged:
+    __slots__ = ("expires", "next", "parts")
+
+    def __init__(self, parts: list[str], expires: float) -> None:
+        self.parts = parts
+        self.next = 1  # the first part went out with the answer
+        self.expires = expires
+
+
+class PageStore:
+    """Each recipient's last long reply, split into parts, so ``more`` can send the
+    rest without looking anything up again.
+
+    A new answer replaces the recipient's parts. Parts expire after ``ttl`` seconds,
+    and past ``max_sessions`` recipients the one idle longest is dropped, so memory
+    stays bounded at roughly ``max_sessions * MAX_PAGES`` SMS.
+
+    The parts live in this process only, so replies are paged only once it's
+    ``resident`` (polling or serving the control socket). A ``--once`` run, gone
+    before any ``more`` arrives, truncates instead.
+    """
+
+    def __init__(self, max_sessions: int = PAGE_SESSIONS, ttl: float = PAGE_TTL) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.resident = False
+        self._sessions: OrderedDict[str, _Paged] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(
+        self, session: str, text: str, limit: int, measure: Callable[[str], int] = len
+    ) -> str:
+        """The first part of ``text``, keeping the rest for ``session``."""
+        parts = paginate(text, limit, measure=measure)
+        with self._lock:
+            self._sessions.pop(session, None)
+            if len(parts) > 1:
+                self._sessions[session] = _Paged(parts, monotonic() + self.ttl)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+        return parts[0]
+
+    def more(self, session: str, page: int | None = None) -> str:
+        """The next part for ``session``, or part ``page`` (counting from 1)."""
+        with self._lock:
+            paged = self._sessions.get(session)
+            if paged is None or paged.expires < monotonic():
+                self._sessions.pop(session, None)
+                return NO_MORE_REPLY
+            n = page - 1 if page is not None else paged.next  # "more 0" is out of range
+            if n >= len(paged.parts) and page is None:
+                return NO_MORE_REPLY
+            count = len(paged.parts)
+            if not 0 <= n < count:
+                return f"That reply has {count} parts: text 'more 1' to 'more {count}'."
+            paged.next = n + 1
+            self._sessions.move_to_end(session)
+            metrics.inc("remotesearch_pages_served_total")
+            return paged.parts[n]
+
+    def forget(self, session: str) -> None:
+        with self._lock:
+            self._sessions.pop(session, None)
+
+
+pages = PageStore()
+
+
+def _reply(
+    tag: str, target: str, result: str | None, limit: int, session: str | None = None
+) -> str:
+    if result is None:
+        if session is not None:
+            pages.forget(session)  # so "more" doesn't continue an older reply
+        return truncate(*pack_reply(f"No results for '{target}'.", limit))
+    text, limit, measure = pack_reply(f"{tag}: {result}", limit)
+    if session is not None and pages.resident:
+        return pages.start(session, text, limit, measure)
+    return truncate(text, limit, measure)
+
+
+def answer(query: str, limit: int = DEFAULT_SMS_CHARS, *, session: str | None = None) -> str:
     """Route a query to a source (or a web search) and format it for one SMS reply.
 
     Never raises: a broken source falls back to a web search, and an empty result
-    becomes a plain "no results" reply.
+    becomes a plain "no results" reply. With a ``session`` (who the reply goes to),
+    in a resident process, the rest of a reply too long for one SMS is kept in
+    :data:`pages`, and ``more`` or ``more N`` from that session answers from there,
+    without another lookup.
     """
     query = query.strip()
     if not query:
-        return "Empty message. Text 'help' for commands."
+        return EMPTY_REPLY
+    if query.lower().strip(":,") in HELP_WORDS:  # "help me ..." is a real query
+        return truncate(help_text(), limit)
+    if session is not None and pages.resident and (more := MORE_COMMAND.fullmatch(query)):
+        return pages.more(session, int(more[1]) if more[1] else None)
 
-    command, _, rest = query.partition(" ")
-    key = command.lower().strip(":,")
-    if key in HELP_WORDS and not rest.strip():  # "help me ..." is a real query, not the command
-        return truncate(HELP_TEXT, limit)
-
-    provider = ROUTES.get(key)
-    target, tag, result = query, "web", None
-    if provider and rest.strip():
-        target = rest.strip()
-        result = run_source(provider, target)
-        if result is not None:
-            tag = key
+    with timed(metrics.histogram("remotesearch_answer_seconds")):
+        return _answer_routed(query, limit, session)
+
+
+def _answer_routed(query: str, limit: int, session: str | None = None) -> str:
+    tag, target, result = _lookup(*route(query))
+    return _reply(tag, target, result, limit, session)
+
+
+def _lookup(key: str, spec: SourceSpec | None, target: str) -> tuple[str, str, str | None]:
+    result = run_command(spec, target) if spec else None
+    tag = key if result is not None else "web"
     if result is None:  # no command, or the command's source came up empty
         result = default_search(target)
-    if result is None:
-        return truncate(f"No results for '{target}'.", limit)
-    return truncate(f"{tag}: {result}", limit)
+    return tag, target, result
+
+
+# --------------------------------------------------------------------------- #
+# Prefetch — keep the answers people keep asking for fresh
+# --------------------------------------------------------------------------- #
+PREFETCH_BUDGET = 4  # lookup cost units per idle tick; 0 turns prefetching off
+PREFETCH_MIN_ASKS = 2
+PREFETCH_WINDOW = 86400  # only queries asked within the last day
+PREFETCH_LEAD = 300  # refresh answers due to expire within this many seconds
+PREFETCH_EVERY = 60  # seconds between runs when there's no poller to time them
+
+
+class Prefetcher:
+    """Looks up popular queries again just before their cached answers expire, so
+    the next time someone asks it's a cache hit: the weather for places people
+    keep checking stays fresh all day, and nobody waits on a lookup for it.
+
+    Popular means asked at least ``min_asks`` times, the last time within
+    ``window`` seconds, per the answer cache's ``asked`` table; an answer that has
+    already expired counts as due too. Each :meth:`run` spends at most ``budget``
+    units of the sources' :attr:`SourceSpec.cost` (most asked first) on the lookup
+    pool, in the background, and skips a run while the last one is still going.
+    """
+
+    def __init__(
+        self,
+        budget: int = PREFETCH_BUDGET,
+        *,
+        min_asks: int = PREFETCH_MIN_ASKS,
+        window: float = PREFETCH_WINDOW,
+        lead: float = PREFETCH_LEAD,
+    ) -> None:
+        self.budget = budget
+        self.min_asks = min_asks
+        self.window = window
+        self.lead = lead
+        self._running: Future[int] | None = None
+
+    def due(self) -> list[tuple[str, str]]:
+        """``(source, query)`` pairs to refresh now, most asked first."""
+        now = time()
+        try:
+            return answer_cache.popular(
+                since=now - self.window,
+                min_asks=self.min_asks,
+                expiring=now + self.lead,
+                limit=self.budget,
+            )
+        except sqlite3.Error as exc:
+            logger.warning("prefetch skipped: %s", exc)
+            return []
+
+    def run(self) -> Future[int] | None:
+        """Start refreshing what's due on the lookup pool, unless nothing is or the
+        previous run is still going."""
+        if self.budget <= 0 or (self._running is not None and not self._running.done()):
+            return None
+        due = self.due()
+        if not due:
+            return None
+        self._running = lookup_pool().submit(self._refresh, due)
+        return self._running
+
+    def _refresh(self, due: list[tuple[str, str]]) -> int:
+        costs = {
+            getattr(spec.func, "__name__", ""): spec.cost for spec in COMMANDS.values() if spec.func
+        }
+        spent = refreshed = 0
+        background.on = True
+        try:
+            for source, query in due:
+                refresh = refreshers.get(source)
+                cost = costs.get(source, 1)
+                if refresh is None or spent + cost > self.budget:
+                    continue
+                spent += cost
+                key = query_key(query)
+                try:
+                    result = in_flight.do((source, key), partial(refresh, query, key))
+                except Exception as exc:  # a prefetch must never take the lookup pool down
+                    logger.debug("prefetch %s %r failed: %s", source, query, exc)
+                    result = None
+                outcome = "refreshed" if result else "empty"
+                metrics.inc("remotesearch_prefetch_total", source=source, outcome=outcome)
+                refreshed += bool(result)
+        finally:
+            background.on = False
+        return refreshed
+
+
+prefetcher = Prefetcher()
+
+
+# --------------------------------------------------------------------------- #
+# Async API — the same lookups for callers running an event loop. The sources stay
+# plain functions over the pooled session; these await them on the lookup pool, so
+# any number of queued lookups costs a coroutine each, and the threads stay bounded.
+# --------------------------------------------------------------------------- #
+# asyncio is imported in each function rather than at the top, so the CLI and cron
+# runs, which never touch it, don't pay for importing it.
+async def get_json_async(url: str, **params: Any) -> Any:
+    """Awaitable :func:`get_json`."""
+    import asyncio
+
+    return await asyncio.get_running_loop().run_in_executor(
+        lookup_pool(), partial(get_json, url, **params)
+    )
+
+
+async def run_source_async(source: Source, arg: str) -> str | None:
+    """Awaitable :func:`run_source`: the async variant of any ``source_*`` function."""
+    import asyncio
+
+    return await asyncio.get_running_loop().run_in_executor(lookup_pool(), run_source, source, arg)
+
+
+async def default_search_async(query: str) -> str | None:
+    """Awaitable :func:`default_search`. The race is coordinated on the loop's default
+    executor, never on the lookup pool its sources run in, so it can't starve them."""
+    import asyncio
+
+    return await asyncio.get_running_loop().run_in_executor(None, default_search, query)
+
+
+async def answer_async(
+    query: str, limit: int = DEFAULT_SMS_CHARS, *, session: str | None = None
+) -> str:
+    """Awaitable :func:`answer`: the same call, so routing, paging and the answer
+    metrics never drift from it. Runs on the loop's default executor, like
+    :func:`default_search_async`, since it waits on the lookup pool itself."""
+    import asyncio
+
+    return await asyncio.get_running_loop().run_in_executor(
+        None, partial(answer, query, limit, session=session)
+    )
+
+
+async def answer_many_async(
+    queries: list[str], limit: int = DEFAULT_SMS_CHARS, *, concurrency: int = DEFAULT_WORKERS
+) -> list[str]:
+    """Answer many queries at once, at most ``concurrency`` in flight, replies in order."""
+    import asyncio
+
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(query: str) -> str:
+        async with gate:
+            return await answer_async(query, limit)
+
+    return list(await asyncio.gather(*(one(q) for q in queries)))
 
 
 # --------------------------------------------------------------------------- #
 # Gmail
 # --------------------------------------------------------------------------- #
 def authenticate_gmail(config: dict[str, str]) -> Any:
-    """Build a Gmail service, reusing the cached OAuth token when it's still valid."""
-    from google.auth.transport.requests import Request
-    from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import InstalledAppFlow
-    from googleapiclient.discovery import build
+    """Build a Gmail service, reusing the cached OAuth token when it's still valid.
+
+    Built from the discovery document bundled with google-api-python-client, so a
+    cron run never fetches it, and without the discovery file cache, which only
+    logs warnings without oauth2client. The OAuth flow and token refresh stacks are
+    only imported when they're needed.
+    """
+    with startup.step("import google client"):
+        from google.oauth2.credentials import Credentials
+        from googleapiclient.discovery import build
 
     scopes = [config.get("GMAIL_SCOPE", DEFAULT_SCOPE)]
     token_path = Path(config["GMAIL_TOKEN_FILE"])
@@ -374,18 +2494,51 @@ def authenticate_gmail(config: dict[str, str]) -> Any:
         )
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            from google.auth.transport.requests import Request
+
+            with startup.step("refresh oauth token"):
+                creds.refresh(Request())
         else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
             flow = InstalledAppFlow.from_client_secrets_file(
                 config["GMAIL_CREDENTIALS_FILE"], scopes
             )
             creds = flow.run_local_server(port=0)
         token_path.write_text(creds.to_json(), encoding="utf-8")
-    return build("gmail", "v1", credentials=creds)
+    with startup.step("build gmail service"):
+        return build("gmail", "v1", credentials=creds, static_discovery=True, cache_discovery=False)
+
+
+class QuotaMeter:
+    """Gmail quota units spent over a sliding hour, so a deployment can see how much
+    of its per-user allowance the poller burns."""
+
+    def __init__(self, window: float = 3600) -> None:
+        self.window = window
+        self._spent: deque[tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+
+    def charge(self, method: str, calls: int = 1) -> None:
+        metrics.inc("remotesearch_gmail_calls_total", calls, method=method)
+        with self._lock:
+            self._spent.append((time(), GMAIL_QUOTA_UNITS[method] * calls))
+
+    def last_hour(self) -> int:
+        cutoff = time() - self.window
+        with self._lock:
+            while self._spent and self._spent[0][0] < cutoff:
+                self._spent.popleft()
+            return sum(units for _, units in self._spent)
+
+
+gmail_quota = QuotaMeter()
+metrics.gauge("remotesearch_gmail_quota_units_last_hour", gmail_quota.last_hour)
 
 
 def get_label_id(service: Any, label_name: str) -> str | None:
     """Resolve a Gmail label's display name to its ID."""
+    gmail_quota.charge("labels.list")
     labels = service.users().labels().list(userId="me").execute().get("labels", [])
     for label in labels:
         if label["name"].lower() == label_name.lower():
@@ -395,10 +2548,10 @@ def get_label_id(service: Any, label_name: str) -> str | None:
 
 
 def _find_body(part: dict[str, Any], mime: str) -> str | None:
-    """Walk a (possibly nested multipart) payload for the first body of ``mime``."""
+    """Walk a (possibly nested multipart) payload for the first body of ``mime``,
+    still base64-encoded; :func:`_decode_body` decodes as much as is wanted."""
     if part.get("mimeType") == mime and part.get("body", {}).get("data"):
-        raw = base64.urlsafe_b64decode(part["body"]["data"])
-        return raw.decode("utf-8", "replace")
+        return str(part["body"]["data"])
     for sub in part.get("parts", []):
         found = _find_body(sub, mime)
         if found:
@@ -406,100 +2559,1154 @@ def _find_body(part: dict[str, Any], mime: str) -> str | None:
     return None
 
 
+def _decode_body(data: str, chunk: int = 8192) -> Iterator[str]:
+    """Decode Gmail's URL-safe base64 body ``chunk`` characters at a time, so a caller
+    that only needs the start of a big MMS body never decodes the rest."""
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    for start in range(0, len(data), chunk):  # chunk is a multiple of 4
+        piece = data[start : start + chunk]
+        yield decoder.decode(base64.urlsafe_b64decode(piece + "=" * (-len(piece) % 4)))
+    yield decoder.decode(b"", final=True)
+
+
+def _head(pieces: Iterator[str], limit: int) -> str:
+    """Up to ``limit`` characters from the start of ``pieces``, reading no further."""
+    text = ""
+    for piece in pieces:
+        text += piece
+        if len(text) >= limit:
+            return text[:limit]
+    return text
+
+
+def sender_of(message: dict[str, Any]) -> str:
+    """The message's ``From`` header (the gateway address of the texting phone)."""
+    for header in message.get("payload", {}).get("headers", []):
+        if header.get("name", "").lower() == "from":
+            return str(header.get("value", ""))
+    return ""
+
+
 def extract_query(message: dict[str, Any]) -> str | None:
     """Pull the user's text out of a message, preferring plain text over HTML."""
     payload = message.get("payload", {})
     plain = _find_body(payload, "text/plain")
-    if plain:
-        return clean_query(plain)
+    text = _head(_decode_body(plain), MAX_QUERY_CHARS) if plain else ""
+    if text:
+        return clean_query(text)
     html = _find_body(payload, "text/html")
-    return html_to_text(html) if html else None
+    return html_to_text(_decode_body(html)) if html else None
 
 
 def unread_ids(service: Any, label_id: str) -> list[str]:
-    """IDs of unread messages under the label, oldest first."""
-    resp = service.users().messages().list(userId="me", labelIds=[label_id, "UNREAD"]).execute()
-    return [m["id"] for m in reversed(resp.get("messages", []))]
+    """IDs of unread messages under the label, oldest first, across every page.
+
+    Gmail lists newest first, so the whole listing is read before reversing; IDs are
+    tiny, and even a big backlog is a few pages of 500.
+    """
+    ids: list[str] = []
+    page_token = None
+    while True:
+        gmail_quota.charge("messages.list")
+        resp = (
+            service.users()
+            .messages()
+            .list(
+                userId="me",
+                labelIds=[label_id, "UNREAD"],
+                maxResults=LIST_PAGE,
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        ids.extend(m["id"] for m in resp.get("messages", []))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return ids[::-1]
+
+
+def fetch_messages(service: Any, ids: list[str]) -> dict[str, dict[str, Any]]:
+    """Fetch messages in one batched HTTP round trip. Returns those that came back;
+    one that failed is logged and left out, so it stays unread and is retried."""
+    fetched: dict[str, dict[str, Any]] = {}
+
+    def collect(msg_id: str, response: dict[str, Any], exception: Exception | None) -> None:
+        if exception is not None:
+            logger.error("failed to fetch message %s: %s", msg_id, exception)
+        else:
+            fetched[msg_id] = response
+
+    batch = service.new_batch_http_request(callback=collect)
+    for msg_id in ids:
+        request = service.users().messages().get(userId="me", id=msg_id, fields=MESSAGE_FIELDS)
+        batch.add(request, request_id=msg_id)
+    gmail_quota.charge("messages.get", len(ids))
+    batch.execute()
+    return fetched
+
+
+def mark_read(service: Any, ids: list[str]) -> None:
+    """Mark messages read with a single ``batchModify`` call (Gmail takes up to 1000)."""
+    for start in range(0, len(ids), 1000):
+        gmail_quota.charge("messages.batchModify")
+        service.users().messages().batchModify(
+            userId="me", body={"ids": ids[start : start + 1000], "removeLabelIds": ["UNREAD"]}
+        ).execute()
 
 
-def mark_read(service: Any, msg_id: str) -> None:
-    service.users().messages().modify(
-        userId="me", id=msg_id, body={"removeLabelIds": ["UNREAD"]}
-    ).execute()
+def history_id(service: Any) -> str:
+    """The mailbox's current history ID, the starting point for :func:`new_message_ids`."""
+    gmail_quota.charge("getProfile")
+    return str(service.users().getProfile(userId="me").execute()["historyId"])
+
+
+def new_message_ids(service: Any, label_id: str, start: str) -> tuple[list[str], str] | None:
+    """IDs of unread messages added under the label since history ID ``start``, oldest
+    first, plus the history ID to resume from on the next call.
+
+    One cheap ``history.list`` call replaces a full unread listing on every tick. Returns
+    None when ``start`` is older than Gmail keeps history for (about a week), in which
+    case the caller has to fall back to :func:`unread_ids`.
+    """
+    delta = new_messages_by_label(service, [label_id], start)
+    return None if delta is None else (delta[0][label_id], delta[1])
+
+
+def new_messages_by_label(
+    service: Any, label_ids: list[str], start: str
+) -> tuple[dict[str, list[str]], str] | None:
+    """Like :func:`new_message_ids` for several labels at once, still one history call
+    per tick: unread messages added since ``start``, grouped by label. A message under
+    more than one of the labels goes to the first of them.
+    """
+    ids: dict[str, dict[str, None]] = {label: {} for label in label_ids}  # ordered sets
+    latest, page_token = start, None
+    while True:
+        gmail_quota.charge("history.list")
+        try:
+            resp = (
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start,
+                    labelId=label_ids[0] if len(label_ids) == 1 else None,
+                    historyTypes=["messageAdded"],
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+        except Exception as exc:  # googleapiclient's HttpError; only a 404 is expected
+            if getattr(getattr(exc, "resp", None), "status", None) == 404:
+                return None
+            raise
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                labels = added["message"].get("labelIds", [])
+                if "UNREAD" in labels:
+                    for label in label_ids:
+                        if label in labels:
+                            ids[label][added["message"]["id"]] = None
+                            break
+        latest = str(resp.get("historyId", latest))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return {label: list(found) for label, found in ids.items()}, latest
 
 
 # --------------------------------------------------------------------------- #
 # Twilio
 # --------------------------------------------------------------------------- #
-def make_sender(config: dict[str, str], dry_run: bool) -> Callable[[str], None]:
-    """Return a ``send(text)`` function. In dry-run mode it logs instead of texting.
+class _Callbacks:
+    __slots__ = ("failed", "sent")
+
+    def __init__(self, sent: list[Callable[[], None]], failed: list[Callable[[], None]]) -> None:
+        self.sent = sent  # once Twilio accepts the text
+        self.failed = failed  # once the outbox gives up on it
 
-    The Twilio client is built once and reused across the whole run.
+
+class SmsOutbox:
+    """Non-blocking send queue in front of Twilio (or the dry-run logger).
+
+    ``outbox(text)`` returns at once and a background thread does the sending, so the
+    poll loop never waits on Twilio. That thread sends at most ``rate`` texts a
+    second, in bursts of up to ``burst``, and retries a 429 with exponential backoff.
+    With ``coalesce`` set, it holds each reply that long and folds later replies to
+    the same number into it, as long as the combined text still fits a ``limit``-char
+    reply's segments (see :func:`reply_budget`), whatever its encoding.
+    """
+
+    def __init__(
+        self,
+        deliver: Callable[[str, str], None],
+        to: str,
+        *,
+        rate: float = 1.0,
+        burst: int = 5,
+        coalesce: float = 0.0,
+        limit: int = DEFAULT_SMS_CHARS,
+        retries: int = 3,
+        backoff: float = 1.0,
+    ) -> None:
+        self.deliver = deliver
+        self.to = to
+        self.bucket = TokenBucket(rate, burst)
+        self.coalesce = coalesce
+        self.limit = limit
+        self.retries = retries
+        self.backoff = backoff
+        # (to, text, queued at, callbacks to run once it's delivered or has failed)
+        self._queue: deque[tuple[str, str, float, _Callbacks]] = deque()
+        self._ready = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="sms-outbox", daemon=True)
+        self._thread.start()
+
+    def __call__(
+        self,
+        text: str,
+        to: str | None = None,
+        on_sent: Callable[[], None] | None = None,
+        on_failed: Callable[[], None] | None = None,
+    ) -> None:
+        """Queue ``text`` for ``to`` (default: the configured number). ``on_sent`` runs
+        on the outbox thread once Twilio has accepted it, ``on_failed`` once it has
+        given up on it."""
+        callbacks = _Callbacks([on_sent] if on_sent else [], [on_failed] if on_failed else [])
+        with self._ready:
+            self._queue.append((to or self.to, text, monotonic(), callbacks))
+            self._ready.notify()
+
+    def pending(self) -> int:
+        with self._ready:
+            return len(self._queue)
+
+    def close(self, timeout: float | None = None) -> None:
+        """Send everything still queued (no more coalescing waits), then stop."""
+        with self._ready:
+            self._closing = True
+            self._ready.notify()
+        self._thread.join(timeout)
+
+    def _next(self) -> tuple[str, str, _Callbacks] | None:
+        """The next message to send, after its coalescing window; None once closed."""
+        with self._ready:
+            while not self._queue:
+                if self._closing:
+                    return None
+                self._ready.wait()
+            to, text, queued, callbacks = self._queue[0]
+            while not self._closing and monotonic() < queued + self.coalesce:
+                self._ready.wait(queued + self.coalesce - monotonic())
+            self._queue.popleft()
+            for item in list(self._queue) if self.coalesce else ():
+                # Fold in later replies to the same number while they still fit.
+                merged = f"{text}\n{item[1]}"
+                encoding = sms_encoding(merged)
+                if item[0] == to and sms_units(encoding)(merged) <= reply_budget(
+                    self.limit, encoding
+                ):
+                    text = merged
+                    callbacks = _Callbacks(
+                        callbacks.sent + item[3].sent, callbacks.failed + item[3].failed
+                    )
+                    self._queue.remove(item)
+                    metrics.inc("remotesearch_sms_coalesced_total")
+                elif item[0] == to:
+                    break  # keep this number's replies in order
+            return to, text, callbacks
+
+    def _run(self) -> None:
+        while (message := self._next()) is not None:
+            while not self.bucket.try_take():
+                sleep(max(self.bucket.wait_time(), 0.01))
+            self._send(*message)
+
+    def _send(self, to: str, text: str, callbacks: _Callbacks) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                with timed(metrics.histogram("remotesearch_sms_send_seconds")):
+                    self.deliver(to, text)
+                metrics.inc("remotesearch_sms_total", outcome="sent")
+                encoding, segments = sms_segments(text)
+                metrics.inc("remotesearch_sms_segments_total", segments, encoding=encoding)
+                for callback in callbacks.sent:
+                    callback()
+                return
+            except Exception as exc:  # Twilio raises many subclasses; one text failing is not fatal
+                if getattr(exc, "status", None) == 429 and attempt < self.retries:
+                    metrics.inc("remotesearch_sms_total", outcome="throttled")
+                    sleep(self.backoff * 2**attempt)
+                    continue
+                logger.error("failed to send SMS: %s", exc)
+                metrics.inc("remotesearch_sms_total", outcome="error")
+                for callback in callbacks.failed:
+                    callback()
+                return
+
+
+def make_sender(
+    config: dict[str, str], dry_run: bool, *, client: Any = None, limit: int = DEFAULT_SMS_CHARS
+) -> SmsOutbox:
+    """Return a ``send(text)`` outbox. In dry-run mode it logs instead of texting.
+
+    The Twilio client is built on the first send and reused across the whole run, so
+    a cron run with nothing to answer never imports it; pass ``client`` to use
+    another (a fake, in tests). ``SMS_RATE`` (texts a minute), ``SMS_BURST``
+    and ``SMS_COALESCE`` (seconds) shape the outbox.
     """
     if dry_run:
-        return lambda text: logger.info("[dry-run] would send: %s", text)
 
-    from twilio.rest import Client
+        def deliver(to: str, text: str) -> None:
+            logger.info("[dry-run] would send to %s: %s", to, text)
+
+    else:
+        from_ = config["TWILIO_PHONE_FROM"]
 
-    client = Client(config["TWILIO_ACCOUNT_SID"], config["TWILIO_AUTH_TOKEN"])
-    to, from_ = config["PHONE_TO"], config["TWILIO_PHONE_FROM"]
+        def deliver(to: str, text: str) -> None:
+            nonlocal client
+            if client is None:  # only ever called from the outbox thread
+                with startup.step("twilio client"):
+                    from twilio.rest import Client
 
-    def send(text: str) -> None:
-        try:
+                    client = Client(config["TWILIO_ACCOUNT_SID"], config["TWILIO_AUTH_TOKEN"])
             sms = client.messages.create(to=to, from_=from_, body=text)
             logger.info("sent %s", sms.sid)
-        except Exception as exc:  # Twilio raises many subclasses; one text failing is not fatal
-            logger.error("failed to send SMS: %s", exc)
 
-    return send
+    outbox = SmsOutbox(
+        deliver,
+        config.get("PHONE_TO", ""),
+        rate=float(config.get("SMS_RATE", 60)) / 60,
+        burst=int(config.get("SMS_BURST", 5)),
+        coalesce=float(config.get("SMS_COALESCE", 0)),
+        limit=limit,
+    )
+    metrics.gauge("remotesearch_sms_queued", outbox.pending)
+    return outbox
+
+
+# --------------------------------------------------------------------------- #
+# Journal
+# --------------------------------------------------------------------------- #
+class Journal:
+    """Crash-safe record of how far each message got, so a restart neither loses a
+    question nor pays for the same SMS twice.
+
+    A message goes fetched -> answered (the reply is saved) -> sent (Twilio took
+    it) -> acked (marked read in Gmail). After a crash, :func:`resume` resends saved
+    replies that never went out and marks read the messages whose reply did, and
+    :func:`process_ids` reuses a saved reply instead of looking it up again. A reply
+    whose send failed stays answered until :func:`resend` gets it out. Backed by
+    SQLite in WAL mode, like the answer cache.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._in_flight: set[str] = set()  # queued to send by this process, not yet sent
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id TEXT PRIMARY KEY, recipient TEXT, "
+            "reply TEXT, fetched REAL NOT NULL, sent REAL, acked REAL)"
+        )
+
+    def _run(self, sql: str, args: tuple[Any, ...] = ()) -> list[Any]:
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def state(self, msg_id: str) -> str | None:
+        """``fetched``, ``answered``, ``sent`` or ``acked``; None if never seen."""
+        rows = self._run("SELECT reply, sent, acked FROM messages WHERE id = ?", (msg_id,))
+        if not rows:
+            return None
+        reply, sent, acked = rows[0]
+        if sent is not None:
+            return "acked" if acked is not None else "sent"
+        return "answered" if reply is not None else "fetched"
+
+    def saved_reply(self, msg_id: str) -> tuple[str, str | None] | None:
+        """The reply (and recipient) saved for a message that hasn't been sent yet."""
+        rows = self._run(
+            "SELECT reply, recipient FROM messages WHERE id = ? AND reply IS NOT NULL "
+            "AND sent IS NULL",
+            (msg_id,),
+        )
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    def fetched(self, msg_id: str) -> None:
+        self._run("INSERT OR IGNORE INTO messages (id, fetched) VALUES (?, ?)", (msg_id, time()))
+
+    def answered(self, msg_id: str, reply: str, recipient: str | None = None) -> None:
+        self._run(
+            "INSERT INTO messages (id, recipient, reply, fetched) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET recipient = excluded.recipient, "
+            "reply = excluded.reply",
+            (msg_id, recipient, reply, time()),
+        )
+
+    def queued(self, msg_id: str) -> bool:
+        """Claim a saved reply for sending; False if this process already queued it."""
+        with self._lock:
+            if msg_id in self._in_flight:
+                return False
+            self._in_flight.add(msg_id)
+            return True
+
+    def sent(self, msg_id: str) -> None:
+        self._run("UPDATE messages SET sent = ? WHERE id = ?", (time(), msg_id))
+        self.released(msg_id)
+
+    def released(self, msg_id: str) -> None:
+        """Give up the claim on a reply that failed to send, so it's sent again."""
+        with self._lock:
+            self._in_flight.discard(msg_id)
+
+    def acked(self, ids: list[str]) -> None:
+        now = time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE messages SET acked = ? WHERE id = ?", [(now, i) for i in ids]
+            )
+
+    def unsent(self) -> list[tuple[str, str, str | None]]:
+        """(id, reply, recipient) for every saved reply that never went out."""
+        rows = self._run(
+            "SELECT id, reply, recipient FROM messages WHERE reply IS NOT NULL AND sent IS NULL "
+            "ORDER BY fetched"
+        )
+        return [(r[0], r[1], r[2]) for r in rows]
+
+    def unacked(self) -> list[str]:
+        """Messages whose reply went out but that may still be unread in Gmail."""
+        return [
+            r[0]
+            for r in self._run("SELECT id FROM messages WHERE sent IS NOT NULL AND acked IS NULL")
+        ]
+
+    def prune(self, keep: float = JOURNAL_KEEP) -> None:
+        """Forget finished messages older than ``keep`` seconds. A reply that never went
+        out is kept, even if its message was marked read."""
+        self._run(
+            "DELETE FROM messages WHERE sent IS NOT NULL AND acked IS NOT NULL AND fetched < ?",
+            (time() - keep,),
+        )
+
+
+def send_journaled(
+    journal: Journal, msg_id: str, reply: str, send: Callable[..., None], **extra: Any
+) -> bool:
+    """Queue a saved reply unless it's already on its way; False if it was. A failed
+    send releases it for :func:`resend` to try again."""
+    if not journal.queued(msg_id):
+        return False
+    send(
+        reply,
+        **extra,
+        on_sent=partial(journal.sent, msg_id),
+        on_failed=partial(journal.released, msg_id),
+    )
+    return True
+
+
+def resend(journal: Journal, send: Callable[..., None]) -> None:
+    """Send again every saved reply that never went out and isn't queued now."""
+    for msg_id, reply, recipient in journal.unsent():
+        if send_journaled(journal, msg_id, reply, send, to=recipient):
+            logger.info("resending saved reply for %s", msg_id)
+
+
+def resume(service: Any, journal: Journal, send: Callable[..., None]) -> None:
+    """Finish what a crash interrupted: resend saved replies that never went out, and
+    mark read the messages whose reply did."""
+    resend(journal, send)
+    unacked = journal.unacked()
+    if unacked:
+        mark_read(service, unacked)
+        journal.acked(unacked)
+    journal.prune()
+
+
+# --------------------------------------------------------------------------- #
+# Tenants
+# --------------------------------------------------------------------------- #
+class Tenant:
+    """One Gmail label to answer and where its replies go: a fixed ``phone``, or, when
+    that's empty, back to whoever texted (see :func:`phone_from_address`)."""
+
+    def __init__(self, label: str, phone: str = "", label_id: str = "") -> None:
+        self.label = label
+        self.phone = phone
+        self.label_id = label_id
+
+    def recipient(self, sender: str) -> str | None:
+        return self.phone or phone_from_address(sender)
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.label!r}, {self.phone or 'sender'!r})"
+
+
+def phone_from_address(address: str) -> str | None:
+    """The phone number behind an SMS gateway address, e.g. ``5551234567@txt.att.net``
+    (or ``"Name" <...>``) -> ``+15551234567``. None for an ordinary email address.
+
+    Ten digits are taken as a North American number, like the gateways that send them.
+    """
+    local = parseaddr(address)[1].partition("@")[0]
+    if not re.fullmatch(r"\+?\d{10,15}", local):
+        return None
+    digits = local.lstrip("+")
+    return f"+1{digits}" if len(digits) == 10 else f"+{digits}"
+
+
+def parse_tenants(config: dict[str, str]) -> list[Tenant]:
+    """``TENANTS=Label:+15551234567, Other Label`` (no number: reply to the sender), or
+    the single ``LABEL_NAME``/``PHONE_TO`` pair when that's unset."""
+    spec = config.get("TENANTS", "")
+    if not spec.strip():
+        return [Tenant(config.get("LABEL_NAME", "Remote Server"), config.get("PHONE_TO", ""))]
+    tenants = []
+    for item in spec.split(","):
+        label, _, phone = item.strip().rpartition(":") if ":" in item else (item.strip(), "", "")
+        if label.strip():
+            tenants.append(Tenant(label.strip(), phone.strip()))
+    labels = [t.label.lower() for t in tenants]
+    if not tenants or len(set(labels)) != len(labels):
+        raise SystemExit(f"TENANTS must list distinct labels; got {spec!r}")
+    return tenants
+
+
+def _ring_hash(key: str) -> int:
+    # Stable across processes and hosts, unlike hash().
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto ``nodes``, each placed ``replicas`` times around
+    the ring to even out the load. Adding or removing a node only moves the keys it
+    owns, so resizing a deployment doesn't reshuffle every tenant."""
+
+    def __init__(self, nodes: list[str], replicas: int = 64) -> None:
+        points = sorted(
+            (_ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> str:
+        return self._nodes[bisect(self._hashes, _ring_hash(key)) % len(self._nodes)]
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """``"1/3"`` -> ``(1, 3)``: this process is shard 1 of 3 (counting from 0)."""
+    index, _, count = spec.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        shard = (-1, 0)
+    if not 0 <= shard[0] < shard[1]:
+        raise SystemExit(f"SHARD must look like 0/3 (index/count); got {spec!r}")
+    return shard
+
+
+def shard_tenants(tenants: list[Tenant], index: int, count: int) -> list[Tenant]:
+    """The tenants shard ``index`` of ``count`` serves. Every shard computes the same
+    split from the same TENANTS list, so processes or hosts need no coordination."""
+    ring = HashRing([str(n) for n in range(count)])
+    return [t for t in tenants if ring.node(t.label.lower()) == str(index)]
 
 
 # --------------------------------------------------------------------------- #
 # Poll loop
 # --------------------------------------------------------------------------- #
-def process_once(service: Any, label_id: str, send: Callable[[str], None], limit: int) -> int:
-    """Answer every unread message under the label and mark it read. Returns the count."""
-    ids = unread_ids(service, label_id)
-    handled = 0
-    for msg_id in ids:
-        # Guard each message: one failure must not abort the batch or, worse, leave
-        # a message unread so it's answered again on every future poll.
-        try:
-            message = service.users().messages().get(userId="me", id=msg_id).execute()
-            query = extract_query(message)
-            if query:
-                logger.info("query: %s", query)
-                send(answer(query, limit))
-            else:
-                logger.warning("message %s had no readable text", msg_id)
-            mark_read(service, msg_id)
-            handled += 1
-        except Exception as exc:  # log and move on to the next message
-            logger.error("failed on message %s: %s", msg_id, exc)
+class PollSchedule:
+    """Delay between polls: snaps back to ``fast`` as soon as mail arrives and stretches
+    toward ``slow`` while the label is quiet, so an idle night costs a few API calls
+    and a conversation in progress still gets quick replies."""
+
+    def __init__(self, fast: float, slow: float, factor: float = 1.5) -> None:
+        self.fast = fast
+        self.slow = max(slow, fast)
+        self.factor = factor
+        self.delay = fast
+
+    def next_delay(self, active: bool) -> float:
+        self.delay = self.fast if active else min(self.slow, self.delay * self.factor)
+        return self.delay
+
+
+PIPELINE_STAGES = ("fetch", "extract", "answer", "send", "mark_read")
+
+
+def stage_latency(stage: str) -> Histogram:
+    return metrics.histogram("remotesearch_stage_seconds", stage=stage)
+
+
+def _answer_timed(query: str, limit: int, session: str | None = None) -> str:
+    with timed(stage_latency("answer")):
+        reply = daemon.answer(query, limit, session) if daemon is not None else None
+        return reply if reply is not None else answer(query, limit, session=session)
+
+
+def process_ids(
+    service: Any,
+    ids: list[str],
+    send: Callable[..., None],
+    limit: int,
+    *,
+    workers: int = DEFAULT_WORKERS,
+    journal: Journal | None = None,
+    tenant: Tenant | None = None,
+    pool: ThreadPoolExecutor | None = None,
+) -> list[str]:
+    """Answer the given messages and mark them read. Returns the IDs handled.
+
+    Messages are fetched ``FETCH_BATCH`` at a time in one batched request. Their
+    lookups run on ``workers`` threads (``pool``, if given, else a pool for this
+    call), so one slow source doesn't hold up the rest, but replies to the same
+    sender still go out in the order the texts arrived.
+    Sending and Gmail calls stay on this thread (the Gmail client isn't thread-safe),
+    and each batch is marked read once, with one ``batchModify``, after its replies
+    are out. A message that's already read by the time it's fetched (say, the backlog
+    pass got to it first) is skipped without a reply.
+
+    With a ``journal``, every step is recorded, a message whose reply already went
+    out is only marked read, and a saved reply is sent as is instead of being looked
+    up again. ``send`` must then accept an ``on_sent`` callback, like
+    :class:`SmsOutbox`. With a ``tenant``, each reply goes ``to`` the tenant's
+    recipient for that sender.
+    """
+    ids = list(dict.fromkeys(ids))  # a message listed twice is still answered once
+    handled = []
+    with nullcontext(pool) if pool else ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for start in range(0, len(ids), FETCH_BATCH):
+            chunk = ids[start : start + FETCH_BATCH]
+            with timed(stage_latency("fetch")):
+                messages = fetch_messages(service, chunk)
+            answered = []
+            jobs: dict[Future[str], str] = {}
+            # Per sender, in order: (message, its answer, who the reply goes to).
+            queues: dict[str, deque[tuple[str, Future[str], str | None]]] = {}
+            for msg_id in chunk:
+                message = messages.get(msg_id)
+                if message is None:
+                    continue
+                if "UNREAD" not in message.get("labelIds", ["UNREAD"]):
+                    handled.append(msg_id)
+                    continue
+                future: Future[str]
+                if journal is not None and journal.state(msg_id) in {"sent", "acked"}:
+                    answered.append(msg_id)  # replied before a crash; just ack it
+                    continue
+                sender = sender_of(message)
+                to = tenant.recipient(sender) if tenant else None
+                if tenant and not to:
+                    logger.warning("no number to reply to for %s (from %r)", msg_id, sender)
+                    answered.append(msg_id)
+                    continue
+                if journal is not None and (saved := journal.saved_reply(msg_id)):
+                    future = Future()
+                    future.set_result(saved[0])
+                    to = saved[1] or to
+                else:
+                    with timed(stage_latency("extract")):
+                        query = extract_query(message)
+                    if not query:
+                        logger.warning("message %s had no readable text", msg_id)
+                        answered.append(msg_id)
+                        continue
+                    logger.info("query: %s", query)
+                    if journal is not None:
+                        journal.fetched(msg_id)
+                    future = pool.submit(_answer_timed, query, limit, sender or None)
+                jobs[future] = sender
+                queues.setdefault(sender, deque()).append((msg_id, future, to))
+            for done in as_completed(jobs):
+                # Send whatever is ready at the head of this sender's queue; a later
+                # text that finished first waits there for the earlier one.
+                queue = queues[jobs[done]]
+                while queue and queue[0][1].done():
+                    msg_id, future, to = queue.popleft()
+                    # Guard each message: one failure must not abort the batch or,
+                    # worse, leave a message unread so it's answered again forever.
+                    try:
+                        reply = future.result()
+                        extra: dict[str, Any] = {"to": to} if to else {}
+                        with timed(stage_latency("send")):
+                            if journal is None:
+                                send(reply, **extra)
+                            else:
+                                journal.answered(msg_id, reply, to)
+                                send_journaled(journal, msg_id, reply, send, **extra)
+                        answered.append(msg_id)
+                    except Exception as exc:  # log and move on to the next message
+                        logger.error("failed on message %s: %s", msg_id, exc)
+            try:
+                with timed(stage_latency("mark_read")):
+                    mark_read(service, answered)
+                handled.extend(answered)
+                if journal is not None:
+                    journal.acked(answered)
+            except Exception as exc:  # they'll be answered again; better than never
+                logger.error("failed to mark %d message(s) read: %s", len(answered), exc)
     return handled
 
 
-def monitor(
+def process_once(
     service: Any,
     label_id: str,
-    send: Callable[[str], None],
+    send: Callable[..., None],
+    limit: int,
+    *,
+    workers: int = DEFAULT_WORKERS,
+    journal: Journal | None = None,
+    tenant: Tenant | None = None,
+) -> int:
+    """Answer every unread message under the label and mark it read. Returns the count.
+
+    With a ``journal``, first finishes whatever a previous run left half done.
+    """
+    if journal is not None:
+        resume(service, journal, send)
+    ids = unread_ids(service, label_id)
+    handled = process_ids(
+        service, ids, send, limit, workers=workers, journal=journal, tenant=tenant
+    )
+    return len(handled)
+
+
+def catch_up(
+    service: Any,
+    tenants: list[Tenant],
+    send: Callable[..., None],
+    limit: int,
+    *,
+    skip_backlog: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    journal: Journal | None = None,
+    pool: ThreadPoolExecutor | None = None,
+) -> None:
+    """Finish whatever a previous run left half done, then answer every tenant's
+    unread backlog (or, with ``skip_backlog``, mark it read without replying)."""
+    if journal is not None:
+        resume(service, journal, send)  # saved replies go out even if the backlog doesn't
+    for tenant in tenants:
+        ids = unread_ids(service, tenant.label_id)
+        if skip_backlog:
+            mark_read(service, ids)
+        else:
+            process_ids(
+                service,
+                ids,
+                send,
+                limit,
+                workers=workers,
+                journal=journal,
+                tenant=tenant,
+                pool=pool,
+            )
+
+
+def poll_tick(
+    service: Any,
+    tenants: list[Tenant],
+    cursor: str,
+    pending: dict[str, list[str]],
+    send: Callable[..., None],
+    limit: int,
+    *,
+    workers: int = DEFAULT_WORKERS,
+    journal: Journal | None = None,
+    pool: ThreadPoolExecutor | None = None,
+) -> tuple[str, bool]:
+    """One poll: answer what arrived for every tenant since ``cursor`` (one history
+    call covers them all), plus what failed last time. ``pending`` is updated in
+    place. Returns the next cursor and whether there was anything to do."""
+    delta = new_messages_by_label(service, [t.label_id for t in tenants], cursor)
+    if delta is None:  # history expired (long outage): rescan everything unread
+        logger.warning("history %s expired, rescanning the labels", cursor)
+        cursor = history_id(service)
+        new = {t.label_id: unread_ids(service, t.label_id) for t in tenants}
+    else:
+        new, cursor = delta
+    active = False
+    for tenant in tenants:
+        ids = list(dict.fromkeys(pending.get(tenant.label_id, []) + new[tenant.label_id]))
+        handled = process_ids(
+            service, ids, send, limit, workers=workers, journal=journal, tenant=tenant, pool=pool
+        )
+        pending[tenant.label_id] = [i for i in ids if i not in handled]
+        active = active or bool(ids)
+    return cursor, active
+
+
+def monitor(
+    service: Any,
+    tenants: list[Tenant],
+    send: Callable[..., None],
     *,
     limit: int,
     interval: int,
-    catch_up: bool,
+    max_interval: int,
+    skip_backlog: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    journal: Journal | None = None,
+    metrics_file: str | None = None,
 ) -> None:
-    """Poll forever. On startup, skip the existing backlog unless ``catch_up`` is set."""
-    if not catch_up:
-        for msg_id in unread_ids(service, label_id):
-            mark_read(service, msg_id)
-        send("Remote search online.")
-    logger.info("monitoring label %s", label_id)
+    """Poll forever for every tenant's label. On startup, answer the backlog that
+    built up while the poller was down (or, with ``skip_backlog``, mark it read
+    without replying).
+
+    After startup each tick asks Gmail's history API only for what changed, and the
+    delay between ticks adapts between ``interval`` and ``max_interval``.
+    """
+    pages.resident = True  # "more" reaches this process again, so long replies page
+    # One pool of reply threads for the life of the poller, not one per tick; the
+    # loop never returns, and the interpreter joins its threads at exit.
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="reply")
+    cursor = history_id(service)  # before the backlog pass, so nothing slips between
+    catch_up(
+        service,
+        tenants,
+        send,
+        limit,
+        skip_backlog=skip_backlog,
+        workers=workers,
+        journal=journal,
+        pool=pool,
+    )
+    for phone in dict.fromkeys(t.phone for t in tenants if t.phone):
+        send("Remote search online.", to=phone)
+    logger.info("monitoring %s", ", ".join(t.label for t in tenants))
+    schedule = PollSchedule(interval, max_interval)
+    pending: dict[str, list[str]] = {}  # failed last tick; history won't report them again
+    next_report = time() + 3600
+    next_resend = time() + RESEND_EVERY
     while True:
+        active = False
         try:
-            process_once(service, label_id, send, limit)
+            cursor, active = poll_tick(
+                service,
+                tenants,
+                cursor,
+                pending,
+                send,
+                limit,
+                workers=workers,
+                journal=journal,
+                pool=pool,
+            )
         except Exception as exc:  # keep the loop alive across transient Gmail errors
             logger.error("poll failed: %s", exc)
-        sleep(interval)
+        if not active:
+            prefetcher.run()  # idle: spend the lull refreshing popular answers
+        if journal is not None and time() >= next_resend:
+            resend(journal, send)  # replies Twilio failed on; their texts are already read
+            next_resend = time() + RESEND_EVERY
+        if time() >= next_report:
+            logger.info("gmail quota: %d units in the last hour", gmail_quota.last_hour())
+            for stage in PIPELINE_STAGES:
+                histogram = stage_latency(stage)
+                logger.info(
+                    "%s: %d calls, p50 <= %ss, p99 <= %ss",
+                    stage,
+                    histogram.count,
+                    histogram.percentile(0.5),
+                    histogram.percentile(0.99),
+                )
+            for host, reuse in sorted(connection_reuse().items()):
+                logger.info("%s: %.0f%% of requests reused a connection", host, reuse * 100)
+            if metrics_file:
+                write_metrics(metrics_file)
+            if journal is not None:
+                journal.prune()
+            next_report += 3600
+        sleep(schedule.next_delay(active))
+
+
+# --------------------------------------------------------------------------- #
+# Metrics endpoint
+# --------------------------------------------------------------------------- #
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``/metrics`` (Prometheus text) and ``/metrics.json`` from a daemon thread.
+
+    Binds to localhost by default; put a reverse proxy in front to scrape it remotely.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # let scrapers keep the connection open
+
+        def do_GET(self) -> None:
+            if self.path == "/metrics":
+                body, kind = metrics.render(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, kind = json.dumps(metrics.snapshot()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", kind)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug("metrics: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+def write_metrics(path: str) -> None:
+    """Dump a JSON snapshot of the metrics (for cron runs, which exit before a scrape)."""
+    try:
+        Path(path).write_text(json.dumps(metrics.snapshot(), indent=1), encoding="utf-8")
+    except OSError as exc:
+        logger.warning("could not write metrics to %s: %s", path, exc)
+
+
+# --------------------------------------------------------------------------- #
+# Control socket — a resident daemon answering for other processes
+# --------------------------------------------------------------------------- #
+def _control_request(request: dict[str, Any]) -> dict[str, Any]:
+    op = request.get("op", "answer")
+    if op == "answer":
+        limit = check_limit(int(request.get("limit", DEFAULT_SMS_CHARS)))
+        session = request.get("session")
+        reply = answer(str(request["query"]), limit, session=str(session) if session else None)
+        return {"reply": reply}
+    if op == "ping":
+        return {"ok": True, "pid": os.getpid()}
+    if op == "metrics":
+        return metrics.snapshot()
+    raise ValueError(f"unknown op {op!r}")
+
+
+def serve_control(path: str) -> Any:
+    """Answer queries for other processes on the Unix socket at ``path``, from daemon
+    threads, with this process's warm HTTP pool and caches.
+
+    One JSON object per line each way: ``{"query": "...", "limit": 300}`` gets
+    ``{"reply": "..."}``; ``{"op": "ping"}`` and ``{"op": "metrics"}`` also work. A
+    connection can carry any number of requests. The socket is only accessible to
+    its owner. Returns the server, which callers may ``shutdown()``.
+    """
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            for line in self.rfile:
+                try:
+                    response = _control_request(json.loads(line))
+                except Exception as exc:  # a bad request gets an error, not a dead socket
+                    response = {"error": str(exc)}
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+    command_index()  # discover plugins now rather than on the first query
+    pages.resident = True
+    sock = Path(path)
+    if sock.exists():
+        if DaemonClient(path).ping():
+            raise SystemExit(f"a daemon is already listening on {path}")
+        sock.unlink()  # left behind by one that died
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="control", daemon=True).start()
+    logger.info("answering queries on %s", path)
+    return server
+
+
+class DaemonClient:
+    """Sends queries to a daemon's control socket over one reused connection per
+    thread. Every call returns None rather than raising when the daemon can't be
+    reached, so callers fall back to answering locally."""
+
+    def __init__(self, path: str, timeout: float = 60.0) -> None:
+        self.path = path
+        self.timeout = timeout  # past a lookup's worst case, retries included
+        self._local = threading.local()
+
+    def _connection(self) -> Any:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            import socket
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                return None
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+        return conn
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def call(self, request: dict[str, Any]) -> dict[str, Any] | None:
+        data = json.dumps(request).encode("utf-8") + b"\n"
+        for _ in range(2):  # a kept connection may have died with an old daemon
+            conn = self._connection()
+            if conn is None:
+                return None
+            try:
+                conn[0].sendall(data)
+                line = conn[1].readline()
+            except TimeoutError:
+                self._drop()
+                return None  # not retried: the daemon may still be working on it
+            except OSError:
+                line = b""
+            if line:
+                response: dict[str, Any] = json.loads(line)
+                return response
+            self._drop()
+        return None
+
+    def answer(
+        self, query: str, limit: int = DEFAULT_SMS_CHARS, session: str | None = None
+    ) -> str | None:
+        request: dict[str, Any] = {"query": query, "limit": limit}
+        if session:
+            request["session"] = session
+        response = self.call(request)
+        reply = (response or {}).get("reply")
+        return reply if isinstance(reply, str) else None
+
+    def ping(self) -> bool:
+        return bool((self.call({"op": "ping"}) or {}).get("ok"))
+
+
+daemon: DaemonClient | None = None  # set by connect_daemon() when one is running
+
+
+def connect_daemon(path: str) -> DaemonClient | None:
+    """Send this process's lookups to the daemon at ``path`` if one answers there."""
+    global daemon
+    client = DaemonClient(path)
+    daemon = client if Path(path).exists() and client.ping() else None
+    return daemon
+
+
+# --------------------------------------------------------------------------- #
+# Batch queries — many questions through one process, for evaluation or warm-up
+# --------------------------------------------------------------------------- #
+def answer_record(query: str, limit: int = DEFAULT_SMS_CHARS) -> dict[str, Any]:
+    """:func:`answer` plus how it got there: the route the query took (a command, or
+    ``web``), the source whose answer it is (None for no answer), whether that was
+    already in the cache (an exact key; near matches count as misses), and how
+    long it took."""
+    began = perf_counter()
+    query = query.strip()
+    if not query or query.lower().strip(":,") in HELP_WORDS:
+        record: dict[str, Any] = {
+            "query": query,
+            "route": "help",
+            "source": None,
+            "cache_hit": False,
+        }
+        record["reply"] = answer(query, limit)
+    else:
+        key, spec, target = route(query)
+        if spec is None:
+            cached = [source.__name__ for source in SEARCH_SOURCES.values()]
+        else:
+            cached = [getattr(spec.func, "__name__", "")] if spec.ttl is not None else []
+        hit = any(answer_cache.peek(name, query_key(target)) for name in cached)
+        with timed(metrics.histogram("remotesearch_answer_seconds")):
+            tag, target, result = _lookup(key, spec, target)
+        record = {
+            "query": query,
+            "route": spec.name if spec else "web",
+            "source": tag if result is not None else None,
+            "cache_hit": hit,
+            "reply": _reply(tag, target, result, limit),
+        }
+    record["seconds"] = round(perf_counter() - began, 4)
+    return record
+
+
+def read_queries(lines: Iterable[str]) -> Iterator[str]:
+    """One query per non-blank line, lazily. A JSON object line gives its ``query``,
+    so a results file can be fed back in."""
+    for line in lines:
+        line = line.strip()
+        if line.startswith("{"):
+            with suppress(ValueError, AttributeError):  # not JSON after all: a query
+                line = str(json.loads(line).get("query") or "")
+        if line:
+            yield line
+
+
+def answer_stream(
+    queries: Iterable[str],
+    write: Callable[[dict[str, Any]], None],
+    *,
+    limit: int = DEFAULT_SMS_CHARS,
+    workers: int = DEFAULT_WORKERS,
+    ordered: bool = True,
+) -> int:
+    """Answer ``queries`` on ``workers`` threads and ``write`` each
+    :func:`answer_record` as soon as it can go out: in input order, or as each
+    finishes with ``ordered`` off. ``queries`` is read lazily and at most twice
+    ``workers`` are in flight, so memory stays flat however long the input is.
+    Returns how many were answered."""
+    window = 2 * max(1, workers)
+    written = 0
+    running: deque[Future[dict[str, Any]]] = deque()
+
+    def drain(keep: int) -> None:
+        nonlocal written
+        while len(running) > keep:
+            if ordered:
+                done = [running.popleft()]
+            else:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                done = [future for future in running if future in finished]
+                for future in done:
+                    running.remove(future)
+            for future in done:
+                write(future.result())
+                written += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+        for query in queries:
+            running.append(pool.submit(answer_record, query, limit))
+            drain(window - 1)
+        drain(0)
+    return written
+
+
+def run_batch(path: str, *, limit: int, workers: int, ordered: bool) -> int:
+    """Answer every query in the file at ``path`` (``-`` for stdin), writing JSONL
+    records to stdout."""
+
+    def write(record: dict[str, Any]) -> None:
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    if path == "-":
+        return answer_stream(
+            read_queries(sys.stdin), write, limit=limit, workers=workers, ordered=ordered
+        )
+    with Path(path).open(encoding="utf-8") as lines:
+        return answer_stream(
+            read_queries(lines), write, limit=limit, workers=workers, ordered=ordered
+        )
 
 
 # --------------------------------------------------------------------------- #
@@ -509,11 +3716,50 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Answer emailed questions over SMS.")
     parser.add_argument("--config", default="config.txt", help="path to the config file")
     parser.add_argument("--query", help="answer one query and exit (no Gmail/Twilio needed)")
+    parser.add_argument(
+        "--queries-file",
+        metavar="FILE",
+        help="answer one query per line of FILE (- for stdin) and print JSONL results",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="with --queries-file, print results as they finish instead of in input order",
+    )
     parser.add_argument("--once", action="store_true", help="process current unread mail and exit")
-    parser.add_argument("--catch-up", action="store_true", help="answer the startup backlog too")
-    parser.add_argument("--interval", type=int, help="seconds between polls")
+    parser.add_argument(
+        "--skip-backlog",
+        action="store_true",
+        help="mark mail that arrived while stopped read without answering it",
+    )
+    # Answering the backlog is the default now; the flag is kept for old scripts.
+    parser.add_argument("--catch-up", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--interval", type=int, help="seconds between polls while busy")
+    parser.add_argument("--max-interval", type=int, help="seconds between polls while idle")
     parser.add_argument("--max-chars", type=int, help="max SMS length")
+    parser.add_argument("--workers", type=int, help="lookups to run at once")
     parser.add_argument("--dry-run", action="store_true", help="log replies instead of texting")
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="stay resident and answer other processes on CONTROL_SOCKET (and poll, if set up)",
+    )
+    parser.add_argument(
+        "--local", action="store_true", help="answer in this process even if a daemon is running"
+    )
+    parser.add_argument(
+        "--build-index",
+        nargs="+",
+        metavar="DUMP",
+        help="build KNOWLEDGE_INDEX from Wiktionary .jsonl and Wikipedia abstract .xml dumps",
+    )
+    parser.add_argument("--metrics-port", type=int, help="serve /metrics on this local port")
+    parser.add_argument("--shard", help="serve only shard I of N of the TENANTS, as I/N")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print how long each start-up step took (for imports: python -X importtime)",
+    )
     parser.add_argument("--verbose", action="store_true", help="debug logging")
     return parser.parse_args(argv)
 
@@ -525,27 +3771,119 @@ def main(argv: list[str] | None = None) -> None:
         format="%(asctime)s %(levelname)s %(message)s",
     )
 
-    if args.query:
-        print(answer(args.query, args.max_chars or DEFAULT_SMS_CHARS))
+    with startup.step("config"):
+        config = load_config(args.config)
+        knowledge_path = config.get("KNOWLEDGE_INDEX", DEFAULT_KNOWLEDGE_INDEX)
+        if args.build_index:
+            entries = build_knowledge_index(knowledge_path, args.build_index)
+            logger.info("wrote %d entries to %s", entries, knowledge_path)
+            return
+        configure_knowledge(knowledge_path)
+        configure_cache(
+            config.get("CACHE_FILE", DEFAULT_CACHE_FILE),
+            int(config.get("CACHE_MAX_ENTRIES", DEFAULT_CACHE_ENTRIES)),
+        )
+        configure_search(config)
+        configure_http(config)
+        configure_queries(config)
+        prefetcher.budget = int(config.get("PREFETCH_BUDGET", prefetcher.budget))
+    defer_plugins(config.get("PLUGINS_DIR", "plugins"))
+    metrics_port = args.metrics_port or int(config.get("METRICS_PORT", 0))
+    if metrics_port:
+        serve_metrics(metrics_port)
+    metrics_file = config.get("METRICS_FILE")
+    control = config.get("CONTROL_SOCKET", DEFAULT_CONTROL_SOCKET)
+    limit = reply_limit(config, args.max_chars)
+    if args.queries_file:  # answered here, not by a daemon: the records need the details
+        count = run_batch(
+            args.queries_file,
+            limit=limit,
+            workers=args.workers or int(config.get("WORKERS", DEFAULT_WORKERS)),
+            ordered=not args.unordered,
+        )
+        logger.info("answered %d queries", count)
+        if metrics_file:
+            write_metrics(metrics_file)
         return
+    if args.serve:
+        serve_control(control)
+    elif not args.local:
+        with startup.step("connect to daemon"):
+            connect_daemon(control)
 
-    config = load_config(args.config)
-    require(config, GMAIL_REQUIRED + TWILIO_KEYS)
-    limit = args.max_chars or int(config.get("MAX_SMS_CHARS", DEFAULT_SMS_CHARS))
+    if args.query:
+        with startup.step("answer"):
+            print(_answer_timed(args.query, limit))
+        _report_startup(args)
+        return
+    if args.serve and not all(config.get(key) for key in GMAIL_REQUIRED):
+        logger.info("no Gmail config; only answering on %s", control)
+        while True:
+            prefetcher.run()
+            sleep(PREFETCH_EVERY)
+
+    # With TENANTS, each label names its own number (or replies to the sender).
+    twilio = TWILIO_KEYS if not config.get("TENANTS") else TWILIO_KEYS[:-1]
+    require(config, GMAIL_REQUIRED + twilio)
     interval = args.interval or int(config.get("POLL_INTERVAL", 5))
-
-    service = authenticate_gmail(config)
-    label_id = get_label_id(service, config.get("LABEL_NAME", "Remote Server"))
-    if not label_id:
-        raise SystemExit(1)
-
-    send = make_sender(config, args.dry_run)
+    max_interval = args.max_interval or int(config.get("POLL_MAX_INTERVAL", 60))
+    workers = args.workers or int(config.get("WORKERS", DEFAULT_WORKERS))
+
+    tenants = parse_tenants(config)
+    shard = args.shard or config.get("SHARD")
+    if shard:
+        index, count = parse_shard(shard)
+        tenants = shard_tenants(tenants, index, count)
+        logger.info("shard %d/%d serves %s", index, count, tenants)
+        if not tenants:
+            raise SystemExit(f"shard {shard} has no tenants; run fewer shards")
+
+    with startup.step("gmail"):
+        service = authenticate_gmail(config)
+        with startup.step("resolve labels"):
+            for tenant in tenants:
+                tenant.label_id = get_label_id(service, tenant.label) or ""
+                if not tenant.label_id:
+                    raise SystemExit(1)
+
+    send = make_sender(config, args.dry_run, limit=limit)
+    with startup.step("open journal"):
+        journal = Journal(config.get("JOURNAL_FILE", DEFAULT_JOURNAL_FILE))
     if args.once:
-        count = process_once(service, label_id, send, limit)
+        with startup.step("process unread"):
+            count = sum(
+                process_once(
+                    service, t.label_id, send, limit, workers=workers, journal=journal, tenant=t
+                )
+                for t in tenants
+            )
+        with startup.step("send replies"):
+            send.close()  # don't exit with replies still queued
         logger.info("processed %d message(s)", count)
+        if metrics_file:
+            write_metrics(metrics_file)
+        _report_startup(args)
     else:
-        monitor(service, label_id, send, limit=limit, interval=interval, catch_up=args.catch_up)
+        _report_startup(args)
+        monitor(
+            service,
+            tenants,
+            send,
+            limit=limit,
+            interval=interval,
+            max_interval=max_interval,
+            skip_backlog=args.skip_backlog,
+            workers=workers,
+            journal=journal,
+            metrics_file=metrics_file,
+        )
+
+
+def _report_startup(args: argparse.Namespace) -> None:
+    if args.profile_startup:
+        print(startup.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
+    sys.modules.setdefault("RemoteSearch", sys.modules[__name__])  # one copy for plugins
     main()
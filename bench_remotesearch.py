@@ -0,0 +1,335 @@
+"""Offline benchmark: end-to-end answer() and process_once() against recorded APIs.
+
+Run: python bench_remotesearch.py [--queries 200] [--latency 40] [--error-rate 0.05]
+
+The extract case times query extraction from big carrier MMS bodies against the
+old full BeautifulSoup parse (which needs beautifulsoup4 installed). The knowledge
+case builds an offline index from a synthetic dictionary dump and times lookups in it
+against the same lookups over the network. The segments case counts the SMS
+segments a mix of replies is billed before and after GSM-7 packing, and times the
+segment counter.
+
+Every upstream (DuckDuckGo, Wikipedia, wttr.in, Stack Exchange, Reddit, Dictionary)
+is replayed from bench_fixtures.json by a local stub server that can add latency,
+jitter and errors. Gmail and Twilio are in-memory fakes. Results go to stdout as one
+JSON object, so runs can be diffed or stored and compared for regressions. The stub
+also counts the connections it accepted, so keep-alive regressions show up as
+``upstream_connections`` climbing toward ``upstream_requests``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import logging
+import platform
+import random
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import RemoteSearch
+from fakes_remotesearch import FIXTURES, FakeGmail, StubServer, stubbed_upstreams
+
+# One of each command, plus plain searches, in roughly the mix field users send.
+QUERY_MIX = (
+    "weather Toronto",
+    "define albedo",
+    "wiki albedo",
+    "so sort list of tuples python",
+    "reddit tofino trails",
+    "why is the sky blue",
+    "why is the sky blue",
+    "albedo of snow",
+)
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """p50/p90/p99 and mean, in milliseconds."""
+    if len(samples) < 2:
+        only = samples[0] * 1000 if samples else 0.0
+        return {"p50_ms": only, "p90_ms": only, "p99_ms": only, "mean_ms": only}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p90_ms": round(cuts[89] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def _fresh(query: str, n: int) -> str:
+    # A distinct query each time, so every lookup goes upstream instead of the cache.
+    return f"{query} {n}"
+
+
+def bench_answer(queries: int, *, warm: bool) -> dict[str, Any]:
+    """Sequential answer() calls over QUERY_MIX: per-call latency and throughput."""
+    samples: list[float] = []
+    start = time.perf_counter()
+    for n in range(queries):
+        query = QUERY_MIX[n % len(QUERY_MIX)]
+        began = time.perf_counter()
+        RemoteSearch.answer(query if warm else _fresh(query, n))
+        samples.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    return {"calls": queries, "per_second": round(queries / elapsed, 2), **percentiles(samples)}
+
+
+def bench_process_once(messages: int, *, workers: int, send_delay: float) -> dict[str, Any]:
+    """One process_once() over a backlog of ``messages`` texts from a few senders."""
+    gmail, sent = FakeGmail(), list[str]()
+    for n in range(messages):
+        gmail.add(_fresh(QUERY_MIX[n % len(QUERY_MIX)], n), sender=f"555000000{n % 5}@txt.example")
+
+    send_times: list[float] = []
+    start = time.perf_counter()
+
+    def send(text: str) -> None:
+        time.sleep(send_delay)
+        sent.append(text)
+        send_times.append(time.perf_counter() - start)
+
+    handled = RemoteSearch.process_once(gmail, "L1", send, 300, workers=workers)
+    elapsed = time.perf_counter() - start
+    return {
+        "messages": messages,
+        "handled": handled,
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "per_second": round(handled / elapsed, 2) if elapsed else 0.0,
+        "gmail_calls": len(gmail.calls),
+        "reply_at": percentiles(send_times),
+    }
+
+
+def _mms(html_kb: int) -> dict[str, Any]:
+    """A carrier MMS-to-email message: a short question in an HTML body padded with
+    ``html_kb`` KB of markup, next to an image attachment."""
+    filler = '<tr><td class="footer" style="font:11px Arial">Rogers MMS</td></tr>\n'
+    html = (
+        "<html><head><style>td {padding: 0}</style></head><body>"
+        "<p>why is the sky blue</p><table>"
+        + filler * (html_kb * 1024 // len(filler))
+        + "</table></body></html>"
+    )
+    data = base64.urlsafe_b64encode(html.encode("utf-8")).decode("ascii")
+    return {
+        "payload": {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {"mimeType": "image/jpeg", "body": {"attachmentId": "img", "size": 250_000}},
+                {"mimeType": "text/html", "body": {"data": data}},
+            ],
+        }
+    }
+
+
+def _extract_with_beautifulsoup(message: dict[str, Any]) -> str | None:
+    # The old path: decode the whole body, build a full tree, take all its text.
+    from bs4 import BeautifulSoup
+
+    for part in message["payload"]["parts"]:
+        if part["mimeType"] == "text/html":
+            html = base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8", "replace")
+            return RemoteSearch.clean_query(BeautifulSoup(html, "html.parser").get_text(" "))
+    return None
+
+
+def bench_extract(messages: int, html_kb: int) -> dict[str, Any]:
+    """extract_query() on big MMS bodies, against the full BeautifulSoup parse."""
+    message = _mms(html_kb)
+    paths: dict[str, Callable[[dict[str, Any]], str | None]] = {
+        "streaming": RemoteSearch.extract_query
+    }
+    try:
+        import bs4  # noqa: F401 (only the comparison needs it)
+
+        paths["beautifulsoup"] = _extract_with_beautifulsoup
+    except ImportError:
+        pass
+    results: dict[str, Any] = {"messages": messages, "html_kb": html_kb}
+    for name, extract in paths.items():
+        samples = []
+        for _ in range(messages):
+            began = time.perf_counter()
+            extract(message)
+            samples.append(time.perf_counter() - began)
+        results[name] = percentiles(samples)
+    return results
+
+
+def bench_knowledge(entries: int, queries: int) -> dict[str, Any]:
+    """Build an offline index from a synthetic dictionary dump of ``entries`` words,
+    then time lookups in it against the dictionary source over the (stub) network."""
+    rng = random.Random(0)  # noqa: S311
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = Path(tmp) / "words.jsonl"
+        with dump.open("w", encoding="utf-8") as out:
+            for n in range(entries):
+                sense = {"glosses": [f"Sense of word {n}, in a sentence or two."]}
+                out.write(json.dumps({"word": f"word{n}", "pos": "noun", "senses": [sense]}) + "\n")
+        path = str(Path(tmp) / "knowledge.idx")
+        began = time.perf_counter()
+        RemoteSearch.build_knowledge_index(path, [str(dump)])
+        build = time.perf_counter() - began
+        index = RemoteSearch.KnowledgeIndex(path)
+        words = [f"word{rng.randrange(entries)}" for _ in range(queries)]
+        offline = []
+        for word in words:
+            began = time.perf_counter()
+            index.get("define", word)
+            offline.append(time.perf_counter() - began)
+        results = {
+            "entries": entries,
+            "index_bytes": Path(path).stat().st_size,
+            "build_seconds": round(build, 3),
+            "offline": percentiles(offline),
+        }
+        index.close()
+    lookup = RemoteSearch.source_dictionary.__wrapped__  # type: ignore[attr-defined]
+    online = []
+    for word in words:
+        began = time.perf_counter()
+        lookup(word)
+        online.append(time.perf_counter() - began)
+    results["network"] = percentiles(online)
+    return results
+
+
+# Replies as sources return them: plain, accented, typographic quotes, code, CJK.
+SEGMENT_MIX = (
+    "weather: Toronto: Light snow, -3C (feels -7C), wind 19km/h, humidity 80%",
+    "weather: S\u00e3o Paulo: Partly cloudy, 24C (feels 26C), wind 9km/h, humidity 70%",
+    "wiki: Krak\u00f3w is the second-largest city in Poland. " * 6,
+    "wiki: Albedo is the fraction of sunlight that is diffusely reflected by a body "
+    "\u2013 it\u2019s measured on a scale from 0 to 1 \u201cwhite\u201d to \u201cblack\u201d. " * 3,
+    "so: Use sorted(items, key=lambda t: t[1]) or items.sort(key={...}[1]) in place. " * 4,
+    "web: \u6771\u4eac\u90fd\u306f\u65e5\u672c\u306e\u9996\u90fd\u3067\u3059\u3002 " * 20,
+)
+
+
+def _segments_per_char(text: str) -> tuple[str, int]:
+    # The straightforward version: classify and count one character at a time.
+    basic, extended = set(RemoteSearch.GSM_BASIC), set(RemoteSearch.GSM_EXTENDED)
+    septets = 0
+    for char in text:
+        if char in basic:
+            septets += 1
+        elif char in extended:
+            septets += 2
+        else:
+            units = len(text.encode("utf-16-le")) // 2
+            return "ucs2", 1 if units <= 70 else -(-units // 67)
+    return "gsm7", 1 if septets <= 160 else -(-septets // 153)
+
+
+def bench_segments(replies: int, limit: int) -> dict[str, Any]:
+    """Segments billed per reply before and after GSM-7 packing, and the cost of
+    counting them with the table-driven encoder against a per-character loop."""
+    texts = [SEGMENT_MIX[n % len(SEGMENT_MIX)] for n in range(replies)]
+    before = [RemoteSearch.sms_segments(RemoteSearch.truncate(t, limit))[1] for t in texts]
+    after = [
+        RemoteSearch.sms_segments(RemoteSearch.truncate(*RemoteSearch.pack_reply(t, limit)))[1]
+        for t in texts
+    ]
+    results: dict[str, Any] = {
+        "replies": replies,
+        "limit": limit,
+        "segments_before": sum(before),
+        "segments_after": sum(after),
+    }
+    counters: dict[str, Callable[[str], tuple[str, int]]] = {
+        "table": RemoteSearch.sms_segments,
+        "per_char": _segments_per_char,
+    }
+    for name, count in counters.items():
+        samples = []
+        for text in texts:
+            began = time.perf_counter()
+            count(text)
+            samples.append(time.perf_counter() - began)
+        results[name] = percentiles(samples)
+    samples = []
+    for text in texts:
+        began = time.perf_counter()
+        RemoteSearch.truncate(*RemoteSearch.pack_reply(text, limit))
+        samples.append(time.perf_counter() - began)
+    results["pack"] = percentiles(samples)
+    return results
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    RemoteSearch.configure_cache(":memory:")
+    fixtures = json.loads(FIXTURES.read_text(encoding="utf-8"))
+    server = StubServer(
+        fixtures,
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    results: dict[str, Any] = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "settings": {
+            "queries": args.queries,
+            "messages": args.messages,
+            "workers": args.workers,
+            "latency_ms": args.latency,
+            "jitter_ms": args.jitter,
+            "error_rate": args.error_rate,
+            "send_delay_ms": args.send_delay,
+            "html_kb": args.html_kb,
+            "index_entries": args.index_entries,
+            "seed": args.seed,
+        },
+    }
+    cases: dict[str, Callable[[], dict[str, Any]]] = {
+        "answer_cold": lambda: bench_answer(args.queries, warm=False),
+        "answer_warm": lambda: bench_answer(args.queries, warm=True),
+        "process_once": lambda: bench_process_once(
+            args.messages, workers=args.workers, send_delay=args.send_delay / 1000
+        ),
+        "extract": lambda: bench_extract(args.messages, args.html_kb),
+        "knowledge": lambda: bench_knowledge(args.index_entries, args.queries),
+        "segments": lambda: bench_segments(args.queries, RemoteSearch.DEFAULT_SMS_CHARS),
+    }
+    with stubbed_upstreams(server):
+        for name, case in cases.items():
+            if not args.only or name in args.only:
+                results[name] = case()
+    results["upstream_requests"] = server.hits
+    results["upstream_connections"] = server.connections
+    return results
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark RemoteSearch offline.")
+    parser.add_argument("--queries", type=int, default=200, help="answer() calls per case")
+    parser.add_argument("--messages", type=int, default=60, help="backlog for process_once")
+    parser.add_argument("--workers", type=int, default=RemoteSearch.DEFAULT_WORKERS)
+    parser.add_argument("--latency", type=float, default=40, help="upstream latency, ms")
+    parser.add_argument("--jitter", type=float, default=20, help="+/- latency jitter, ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503s")
+    parser.add_argument("--send-delay", type=float, default=5, help="fake Twilio send, ms")
+    parser.add_argument("--html-kb", type=int, default=200, help="MMS body size for extract")
+    parser.add_argument(
+        "--index-entries", type=int, default=200_000, help="dictionary size for knowledge"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", action="append", help="run just this case (repeatable)")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    logging.basicConfig(level=logging.ERROR)  # injected errors would drown the output
+    print(json.dumps(run(parse_args(argv)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""In-memory and local stand-ins for the services RemoteSearch talks to, shared by
+test_remotesearch.py and bench_remotesearch.py.
+
+FakeGmail stands in for the Gmail API client. StubServer replays the recorded
+upstream responses in bench_fixtures.json over local HTTP, and stubbed_upstreams()
+points the shared session at it.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+
+import RemoteSearch
+
+FIXTURES = Path(__file__).with_name("bench_fixtures.json")
+
+
+class _Request:
+    def __init__(self, result: Any) -> None:
+        self.result = result
+
+    def execute(self) -> Any:
+        return self.result() if callable(self.result) else self.result
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(status)
+        self.resp = type("Resp", (), {"status": status})()
+
+
+class FakeGmail:
+    """Just enough of the Gmail API client for the poller: one mailbox, in memory.
+
+    Every call is recorded in ``calls`` so tests can count round trips.
+    """
+
+    def __init__(self, oldest_history: int = 1) -> None:
+        self.store: dict[str, dict[str, Any]] = {}
+        self.history_log: list[tuple[int, str]] = []
+        self.oldest_history = oldest_history
+        self.calls: list[str] = []
+
+    def add(self, text: str, label: str = "L1", sender: str = "5551234567@txt.example") -> str:
+        msg_id = f"m{len(self.store) + 1}"
+        data = base64.urlsafe_b64encode(text.encode()).decode()
+        self.store[msg_id] = {
+            "id": msg_id,
+            "labelIds": [label, "UNREAD"],
+            "payload": {
+                "mimeType": "text/plain",
+                "headers": [{"name": "From", "value": sender}],
+                "body": {"data": data},
+            },
+        }
+        self.history_log.append((self._history_id() + 1, msg_id))
+        return msg_id
+
+    def unread(self) -> list[str]:
+        return [i for i, m in self.store.items() if "UNREAD" in m["labelIds"]]
+
+    def _history_id(self) -> int:
+        return self.history_log[-1][0] if self.history_log else self.oldest_history
+
+    # Resource tree: service.users().messages().get(...).execute() and friends.
+    def users(self) -> FakeGmail:
+        return self
+
+    def messages(self) -> FakeGmail._Messages:
+        return FakeGmail._Messages(self)
+
+    def history(self) -> FakeGmail._History:
+        return FakeGmail._History(self)
+
+    def getProfile(self, **_: Any) -> _Request:  # noqa: N802
+        self.calls.append("getProfile")
+        return _Request(lambda: {"historyId": str(self._history_id())})
+
+    def new_batch_http_request(self, callback: Any) -> FakeGmail._Batch:
+        return FakeGmail._Batch(self, callback)
+
+    class _Batch:
+        def __init__(self, gmail: FakeGmail, callback: Any) -> None:
+            self.gmail, self.callback = gmail, callback
+            self.requests: list[tuple[_Request, str]] = []
+
+        def add(self, request: _Request, request_id: str) -> None:
+            self.requests.append((request, request_id))
+
+        def execute(self) -> None:
+            self.gmail.calls.append("batch")
+            for request, request_id in self.requests:
+                try:
+                    self.callback(request_id, request.execute(), None)
+                except KeyError as exc:
+                    self.callback(request_id, None, exc)
+
+    class _Messages:
+        def __init__(self, gmail: FakeGmail) -> None:
+            self.gmail = gmail
+
+        def list(self, **kw: Any) -> _Request:
+            self.gmail.calls.append("messages.list")
+            found = [
+                {"id": i}
+                for i, m in reversed(self.gmail.store.items())
+                if set(kw["labelIds"]) <= set(m["labelIds"])
+            ]
+            start, size = int(kw["pageToken"] or 0), kw["maxResults"]
+            page: dict[str, Any] = {}
+            if found[start : start + size]:
+                page["messages"] = found[start : start + size]
+            if start + size < len(found):
+                page["nextPageToken"] = str(start + size)
+            return _Request(page)
+
+        def get(self, id: str, **_: Any) -> _Request:
+            return _Request(lambda: self.gmail.store[id])
+
+        def batchModify(self, body: dict[str, Any], **_: Any) -> _Request:  # noqa: N802
+            self.gmail.calls.append("messages.batchModify")
+
+            def run() -> dict[str, Any]:
+                for msg_id in body["ids"]:
+                    labels = self.gmail.store[msg_id]["labelIds"]
+                    labels[:] = [x for x in labels if x not in body["removeLabelIds"]]
+                return {}
+
+            return _Request(run)
+
+    class _History:
+        def __init__(self, gmail: FakeGmail) -> None:
+            self.gmail = gmail
+
+        def list(self, startHistoryId: str, labelId: str | None, **_: Any) -> _Request:  # noqa: N803
+            self.gmail.calls.append("history.list")
+            start = int(startHistoryId)
+            if start < self.gmail.oldest_history:
+                raise _HttpError(404)
+            records = [
+                {"id": str(h), "messagesAdded": [{"message": self.gmail.store[i]}]}
+                for h, i in self.gmail.history_log
+                if h > start and (labelId is None or labelId in self.gmail.store[i]["labelIds"])
+            ]
+            return _Request({"history": records, "historyId": str(self.gmail._history_id())})
+
+
+class StubServer(ThreadingHTTPServer):
+    """Replays recorded JSON for any upstream, matched by the longest ``host/path``
+    prefix, after ``latency`` +/- ``jitter`` seconds. A request fails with a 503 at
+    ``error_rate``."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        fixtures: dict[str, Any],
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.fixtures = sorted(fixtures.items(), key=lambda item: -len(item[0]))
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.random = random.Random(seed)  # noqa: S311 (not crypto, just reproducible)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.connections = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def respond(self, path: str) -> tuple[int, bytes]:
+        with self.lock:
+            self.hits += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.error_rate
+        time.sleep(delay)
+        if failed:
+            return 503, b'{"error": "injected"}'
+        for prefix, body in self.fixtures:
+            if path.startswith(prefix):
+                return 200, json.dumps(body).encode("utf-8")
+        return 404, b'{"error": "no fixture"}'
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real upstreams
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self) -> None:
+        status, body = self.server.respond(urllib.parse.urlsplit(self.path).path.lstrip("/"))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class StubAdapter(HTTPAdapter):
+    """Sends ``https://host/path?query`` to ``<stub>/host/path?query`` instead."""
+
+    def __init__(self, base_url: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request: PreparedRequest, *args: Any, **kwargs: Any) -> Response:
+        parts = urllib.parse.urlsplit(request.url or "")
+        request.url = f"{self.base_url}/{parts.netloc}{parts.path}" + (
+            f"?{parts.query}" if parts.query else ""
+        )
+        return super().send(request, *args, **kwargs)
+
+
+@contextmanager
+def stubbed_upstreams(server: StubServer) -> Iterator[None]:
+    """Route every fixture host through the stub, keeping the session's retry policy."""
+    sess = RemoteSearch.session()
+    retries = getattr(sess.get_adapter("https://"), "max_retries", None)
+    hosts = {prefix.split("/", 1)[0] for prefix, _ in server.fixtures}
+    saved = dict(sess.adapters)
+    adapter = StubAdapter(
+        server.base_url, max_retries=retries, pool_maxsize=RemoteSearch.HTTP_POOL_SIZE
+    )
+    for host in hosts:
+        sess.mount(f"https://{host}/", adapter)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield
+    finally:
+        server.shutdown()
+        sess.adapters.clear()
+        sess.adapters.update(saved)
@@ -1,18 +1,74 @@
-"""Offline checks for the pure helpers. Run: python test_remotesearch.py
+"""Offline checks. Run: python test_remotesearch.py
 
-Network sources aren't covered here (they need live APIs); exercise those with
+Network sources are checked against the recorded responses in bench_fixtures.json,
+replayed by the stub server in fakes_remotesearch.py. Exercise the live APIs with
 `python RemoteSearch.py --query "..."`.
 """
 
+import asyncio
+import base64
+import gzip
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+import RemoteSearch
+from fakes_remotesearch import FakeGmail
 from RemoteSearch import (
     HELP_TEXT,
+    SEARCH_SOURCES,
+    AnswerCache,
+    CircuitBreaker,
+    HashRing,
+    Histogram,
+    Journal,
+    Metrics,
+    PollSchedule,
+    QuotaMeter,
+    SearchPolicy,
+    SmsOutbox,
+    Tenant,
+    TokenBucket,
+    Upstream,
     answer,
+    answer_async,
+    answer_many_async,
     cache_answers,
     clean_query,
+    default_search,
+    extract_query,
+    get_json,
+    html_text,
     html_to_text,
+    make_sender,
+    metrics,
+    new_message_ids,
+    new_messages_by_label,
+    parse_shard,
+    parse_tenants,
+    phone_from_address,
+    process_ids,
+    process_once,
+    query_key,
+    route,
     run_source,
+    run_source_async,
+    serve_metrics,
+    shard_tenants,
+    source_latency,
     strip_refs,
     truncate,
+    unread_ids,
+    upstream,
 )
 
 
@@ -23,6 +79,66 @@ def test_clean_query() -> None:
 
 def test_html_to_text() -> None:
     assert html_to_text("<p>hello <b>world</b></p>") == "hello world"
+    page = "<head><style>p {}</style></head><p>a &amp; b</p><script>x()</script>"
+    assert html_to_text(page) == "a & b"
+    assert html_text("<p>" + "word " * 10_000, limit=14) == "word word word"
+
+
+def test_extract_query_reads_only_the_start_of_big_bodies() -> None:
+    def part(mime: str, text: str) -> dict[str, Any]:
+        data = base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+        return {"mimeType": mime, "body": {"data": data}}
+
+    html = "<p>caf\u00e9 hours</p>" + "<div>" + "filler " * 100_000 + "</div>"
+    message = {
+        "payload": {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {"mimeType": "image/jpeg", "body": {"attachmentId": "a1"}},
+                {"mimeType": "multipart/alternative", "parts": [part("text/html", html)]},
+            ],
+        }
+    }
+    query = extract_query(message)
+    assert query is not None and query.startswith("caf\u00e9 hours filler")
+    assert len(query) <= RemoteSearch.MAX_QUERY_CHARS
+    # A multi-byte character split across decode chunks survives intact.
+    data = part("text/plain", "\u00e9" * 5)["body"]["data"]
+    assert "".join(RemoteSearch._decode_body(data, chunk=4)) == "\u00e9" * 5
+
+
+def test_to_gsm_keeps_replies_out_of_ucs2() -> None:
+    text = RemoteSearch.to_gsm(
+        "S\u00e3o Paulo \u2013 \u201crain\u201d\u2026 Montr\u00e9al, 3\u00b0C"
+    )
+    assert text == 'Sao Paulo - "rain"... Montr\u00e9al, 3C'  # GSM-7 has \u00e9
+    assert RemoteSearch.sms_segments("x" * 300) == ("gsm7", 2)
+    assert RemoteSearch.sms_segments("x" * 299 + "\u6771") == ("ucs2", 5)
+    assert RemoteSearch.sms_segments("{}" * 80) == ("gsm7", 3)  # escapes are two septets
+
+
+def test_replies_fit_the_segment_budget_in_either_encoding() -> None:
+    for result in ("\u6771\u4eac " * 100, "{x} " * 100, "plain words " * 50):
+        text, limit, measure = RemoteSearch.pack_reply(f"wiki: {result}", 300)
+        reply = truncate(text, limit, measure)
+        assert RemoteSearch.sms_segments(reply)[1] == 2
+        parts = RemoteSearch.paginate(text, limit, measure=measure)
+        assert all(RemoteSearch.sms_segments(part)[1] <= 2 for part in parts)
+    assert limit == 300  # plain GSM-7 still gets the full 300 characters
+
+
+def test_reply_limits_below_a_word_are_refused() -> None:
+    assert truncate("hello world foo", 2) == "..."  # returns instead of looping
+    assert RemoteSearch._prefix("hello", 0, RemoteSearch.sms_units("ucs2")) == ""
+    assert RemoteSearch.reply_limit({"SMS_SEGMENTS": "2"}) == 306
+    assert RemoteSearch.reply_limit({"MAX_SMS_CHARS": "200", "SMS_SEGMENTS": "2"}) == 200
+    for config, max_chars in (({}, 2), ({"MAX_SMS_CHARS": "0"}, None), ({}, 5000)):
+        try:
+            RemoteSearch.reply_limit(config, max_chars)
+        except SystemExit as exc:
+            assert "reply limit" in str(exc)
+        else:
+            raise AssertionError(f"accepted {config} {max_chars}")
 
 
 def test_strip_refs() -> None:
@@ -41,6 +157,295 @@ def test_answer_help() -> None:
     assert answer("") == "Empty message. Text 'help' for commands."
 
 
+def test_answer_async_matches_sync() -> None:
+    assert asyncio.run(answer_async("help")) == answer("help")
+    replies = asyncio.run(answer_many_async(["?", "", "commands"], concurrency=2))
+    assert replies == [HELP_TEXT, "Empty message. Text 'help' for commands.", HELP_TEXT]
+
+
+def test_run_source_async_swallows_errors() -> None:
+    def boom(_: str) -> str | None:
+        raise RuntimeError("network exploded")
+
+    assert asyncio.run(run_source_async(boom, "x")) is None
+    assert asyncio.run(run_source_async(str.upper, "hi")) == "HI"
+
+
+def _racer(delay: float, result: str | None) -> Any:
+    def source(_: str) -> str | None:
+        time.sleep(delay)
+        return result
+
+    source.__name__ = f"racer_{delay}_{result}"
+    return source
+
+
+def test_default_search_races_by_priority_and_deadline() -> None:
+    SEARCH_SOURCES.update(
+        slow=_racer(0.5, "slow"), empty=_racer(0, None), fast=_racer(0.05, "fast")
+    )
+    try:
+        policy = SearchPolicy(("slow", "fast"), deadline=0.2)
+        started = time.monotonic()
+        assert default_search("q", policy) == "fast"  # slow missed the deadline
+        assert time.monotonic() - started < 0.4
+        assert default_search("q", SearchPolicy(("empty", "fast"), deadline=1)) == "fast"
+        assert default_search("q", SearchPolicy(("fast", "slow"), deadline=1)) == "fast"
+        assert default_search("q", SearchPolicy(("slow", "fast"), deadline=1)) == "slow"
+        assert default_search("q", SearchPolicy(("empty",), deadline=1)) is None
+    finally:
+        for name in ("slow", "empty", "fast"):
+            del SEARCH_SOURCES[name]
+
+
+def test_default_search_hedges_past_p95() -> None:
+    calls: list[int] = []
+
+    def stuck_once(_: str) -> str | None:
+        calls.append(1)
+        time.sleep(0.5 if len(calls) == 1 else 0)
+        return f"call {len(calls)}"
+
+    for _ in range(20):
+        source_latency("stuck_once").observe(0.02)
+    SEARCH_SOURCES["stuck"] = stuck_once
+    try:
+        policy = SearchPolicy(("stuck",), deadline=1, hedge=True)
+        assert default_search("q", policy) == "call 2"
+    finally:
+        del SEARCH_SOURCES["stuck"]
+
+
+def test_search_policy_from_config() -> None:
+    policy = SearchPolicy.from_config(
+        {"SEARCH_SOURCES": "Wikipedia, duckduckgo", "SEARCH_DEADLINE": "2", "SEARCH_HEDGE": "1"}
+    )
+    assert (policy.order, policy.deadline, policy.hedge) == (("wikipedia", "duckduckgo"), 2, True)
+    try:
+        SearchPolicy(("altavista",))
+    except SystemExit as exc:
+        assert "altavista" in str(exc)
+    else:
+        raise AssertionError("unknown source accepted")
+    original = RemoteSearch.search_policy
+    try:
+        assert RemoteSearch.configure_search({"SEARCH_DEADLINE": "3"}).deadline == 3
+        assert RemoteSearch.search_policy.deadline == 3
+    finally:
+        RemoteSearch.search_policy = original
+
+
+def test_sources_parse_recorded_responses() -> None:
+    from fakes_remotesearch import FIXTURES, StubServer, stubbed_upstreams
+
+    server = StubServer(json.loads(FIXTURES.read_text(encoding="utf-8")))
+    with stubbed_upstreams(server):
+        # __wrapped__ skips the answer cache, so these always hit the stub.
+        weather = RemoteSearch.source_weather.__wrapped__("Toronto")  # type: ignore[attr-defined]
+        wiki = RemoteSearch.source_wikipedia.__wrapped__("albedo")  # type: ignore[attr-defined]
+        word = RemoteSearch.source_dictionary.__wrapped__("albedo")  # type: ignore[attr-defined]
+        ddg = RemoteSearch.source_duckduckgo.__wrapped__("sky")  # type: ignore[attr-defined]
+        so = RemoteSearch.source_stackoverflow("sort tuples") or ""
+        reddit = RemoteSearch.source_reddit("tofino") or ""
+    assert weather == "Toronto: Light snow, -3C (feels -7C), wind 19km/h, humidity 80%"
+    assert wiki.startswith(
+        "Albedo is the fraction of sunlight that is diffusely reflected by a body."
+    )
+    assert "[1]" not in wiki
+    assert word.startswith("(noun) The fraction of incident light")
+    assert "; (noun) The white inner layer" in word
+    assert ddg.startswith("Rayleigh scattering")
+    assert so.startswith("How to sort a list/tuple") and "sorted(data, key=lambda" in so
+    assert reddit.startswith("Tofino trail conditions this month? (r/britishcolumbia): ")
+
+
+def test_circuit_breaker_opens_and_probes() -> None:
+    breaker = CircuitBreaker("host", threshold=2, cooldown=0.05)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()  # the one half-open probe
+    assert not breaker.allow()
+    breaker.record(False)  # probe failed: open again
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=0, capacity=2)
+    assert bucket.try_take() and bucket.try_take()
+    assert not bucket.try_take()
+    refilling = TokenBucket(rate=100, capacity=1)
+    refilling.pause(0.05)
+    assert not refilling.try_take() and refilling.wait_time() > 0.03
+    time.sleep(0.06)
+    assert refilling.try_take()
+
+
+def test_upstream_pauses_when_quota_spent() -> None:
+    guard = Upstream("api.stackexchange.com")
+    assert guard.allow()
+    guard.adapt({}, {"items": [], "quota_remaining": 0})
+    assert not guard.allow()
+    reddit = Upstream("www.reddit.com")
+    reddit.adapt({"X-Ratelimit-Remaining": "5"}, None)
+    assert reddit.allow()
+
+
+def test_get_json_skips_open_circuit() -> None:
+    upstream("down.example").breaker.trip(60)
+    before = metrics.counter(
+        "remotesearch_http_requests_total", host="down.example", outcome="skipped"
+    )
+    started = time.monotonic()
+    assert get_json("https://down.example/api") is None
+    assert time.monotonic() - started < 0.1  # no network call, no retries
+    after = metrics.counter(
+        "remotesearch_http_requests_total", host="down.example", outcome="skipped"
+    )
+    assert after == before + 1
+
+
+def test_route_forgives_prefixes_typos_and_t9() -> None:
+    for text, command in [
+        ("weather Toronto", "weather"),
+        ("Weat: Toronto", "weather"),
+        ("wether Toronto", "weather"),
+        ("9328437 Toronto", "weather"),  # digits as typed on a keypad
+        ("def albedo", "define"),
+        ("stackoverflw sort list", "so"),
+    ]:
+        assert route(text)[:1] == (command,), text
+    for text in ("red wine", "refine my search", "weather", "what is albedo"):
+        assert route(text)[1] is None, text
+    for text in (
+        "stock price tesla",
+        "snack ideas",
+        "slack outage",
+        "stalk celery",
+        "stick shift",
+        "quack remedies",
+    ):
+        assert route(text)[1:] == (None, text), text
+    for text in ("3428 divided by 4", "9454 km in miles", "9454 x 3", "3428 + 1"):
+        assert route(text)[1:] == (None, text), text  # numbers, not keypad commands
+    assert route("9454 xylophone")[0] == "wiki"
+
+
+def test_plugins_load_lazily_from_a_directory() -> None:
+    saved = dict(RemoteSearch.COMMANDS)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "tide.py").write_text(
+                "import RemoteSearch\n"
+                "@RemoteSearch.register_source('tide', aliases=('tides',), usage='tide <port>')\n"
+                "def source_tide(port):\n"
+                "    return f'high tide at {port} 4:12pm'\n",
+                encoding="utf-8",
+            )
+            (Path(tmp) / "echo.py").write_text("def lookup(q):\n    return q\n", encoding="utf-8")
+            assert RemoteSearch.discover_plugins(tmp) == ["echo", "tide"]
+            assert RemoteSearch.COMMANDS["tide"].func is None  # not imported yet
+            assert answer("tide Tofino") == "tide: high tide at Tofino 4:12pm"
+            assert answer("tides Tofino") == "tide: high tide at Tofino 4:12pm"
+            assert answer("echo hi") == "echo: hi"
+            timings = metrics.histogram("remotesearch_answer_seconds")
+            before = timings.count
+            assert asyncio.run(answer_async("echo hi")) == "echo: hi"
+            assert timings.count == before + 1  # the async path is timed too
+            assert "tide <port>" in answer("help", 500)
+    finally:
+        RemoteSearch.COMMANDS.clear()
+        RemoteSearch.COMMANDS.update(saved)
+
+
+def test_answer_stream_writes_records_in_order_or_as_they_finish() -> None:
+    saved = dict(RemoteSearch.COMMANDS)
+    try:
+
+        @RemoteSearch.register_source("nap", ttl=60)
+        def source_nap(arg: str) -> str:
+            time.sleep(float(arg))
+            return f"slept {arg}"
+
+        lines = ["nap 0.2", "", "help", '{"query": "nap 0.01"}', "nap 0.01"]
+        records: list[dict[str, Any]] = []
+        queries = RemoteSearch.read_queries(lines)
+        assert RemoteSearch.answer_stream(queries, records.append, workers=1) == 4
+        assert [r["query"] for r in records] == ["nap 0.2", "help", "nap 0.01", "nap 0.01"]
+        assert records[0]["route"] == records[0]["source"] == "nap"
+        assert records[0]["reply"] == "nap: slept 0.2" and records[0]["seconds"] >= 0.2
+        assert records[1]["route"] == "help" and "nap <query>" in records[1]["reply"]
+        assert [r["cache_hit"] for r in records] == [False, False, False, True]
+
+        records.clear()
+        queries = RemoteSearch.read_queries(["nap 0.3", "nap 0.02", "nap 0.03"])
+        RemoteSearch.answer_stream(queries, records.append, workers=3, ordered=False)
+        assert [r["query"] for r in records] == ["nap 0.02", "nap 0.03", "nap 0.3"]
+    finally:
+        RemoteSearch.COMMANDS.clear()
+        RemoteSearch.COMMANDS.update(saved)
+
+
+def test_command_timeout_falls_back() -> None:
+    spec = RemoteSearch.SourceSpec("slow", _racer(0.3, "late"), timeout=0.05)
+    assert RemoteSearch.run_command(spec, "x") is None
+    assert RemoteSearch.run_command(RemoteSearch.SourceSpec("fast", str.upper), "x") == "X"
+
+
+def test_import_leaves_heavy_modules_for_later() -> None:
+    probe = (
+        "import sys, RemoteSearch; RemoteSearch.answer('help'); "
+        "print(sorted({'requests', 'asyncio', 'http.server', 'twilio'} & set(sys.modules)))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", probe],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent,
+    )
+    assert out.stdout.strip() == "[]"
+
+
+def test_startup_profile_nests_steps() -> None:
+    profile = RemoteSearch.StartupProfile()
+    with profile.step("gmail"), profile.step("build"):
+        pass
+    with profile.step("journal"):
+        pass
+    names = [line.split()[0] for line in profile.report().splitlines()]
+    assert names == ["gmail", "build", "journal", "total"]
+    assert profile.report().splitlines()[1].startswith("  build")
+
+
+def test_daemon_answers_over_the_control_socket() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "rs.sock")
+        assert RemoteSearch.connect_daemon(path) is None  # nothing listening yet
+        server = RemoteSearch.serve_control(path)
+        try:
+            client = RemoteSearch.connect_daemon(path)
+            assert client is not None and client.ping()
+            began = time.perf_counter()
+            for _ in range(50):
+                assert client.answer("help") == HELP_TEXT
+            assert (time.perf_counter() - began) / 50 < 0.01  # per-call overhead
+            assert client.call({"op": "nope"}) == {"error": "unknown op 'nope'"}
+            assert RemoteSearch._answer_timed("?", 300) == HELP_TEXT
+        finally:
+            server.shutdown()
+            server.server_close()
+            RemoteSearch.daemon = None
+        assert RemoteSearch.DaemonClient(path).answer("help") is None  # callers go local
+        assert RemoteSearch._answer_timed("?", 300) == HELP_TEXT
+
+
 def test_run_source_swallows_errors() -> None:
     def boom(_: str) -> str | None:
         raise RuntimeError("network exploded")
@@ -49,6 +454,30 @@ def test_run_source_swallows_errors() -> None:
     assert run_source(lambda q: q.upper(), "hi") == "HI"
 
 
+def test_identical_concurrent_lookups_share_one_call() -> None:
+    calls: list[str] = []
+
+    def source_slow_echo(query: str) -> str:
+        calls.append(query)
+        time.sleep(0.2)
+        return query.upper()
+
+    before = metrics.counter(
+        "remotesearch_source_calls_total", source="source_slow_echo", outcome="shared"
+    )
+    queries = ["weather Tofino", "Weather  tofino", "weather tofino", "weather Ucluelet"]
+    with ThreadPoolExecutor(len(queries)) as pool:
+        replies = list(pool.map(partial(run_source, source_slow_echo), queries))
+    assert len(calls) == 2
+    assert replies[0] == replies[1] == replies[2] == calls[0].upper()
+    assert replies[3] == "WEATHER UCLUELET"
+    after = metrics.counter(
+        "remotesearch_source_calls_total", source="source_slow_echo", outcome="shared"
+    )
+    assert after == before + 2
+    assert run_source(source_slow_echo, "weather Tofino") and len(calls) == 3  # nothing kept
+
+
 def test_cache_answers_caches_only_success() -> None:
     calls = {"n": 0}
 
@@ -63,6 +492,655 @@ def test_cache_answers_caches_only_success() -> None:
     assert calls["n"] == 2
 
 
+def test_query_key_folds_only_case_and_spacing() -> None:
+    assert query_key("Weather  Toronto") == query_key("weather toronto") == "weather toronto"
+    assert RemoteSearch.query_words("weather YYZ") == ["weather", "toronto"]
+    assert RemoteSearch.query_words("What is the capital of France?") == [
+        "what",
+        "capital",
+        "france",
+    ]
+    assert RemoteSearch.query_words("To be, or?") == ["to", "be", "or"]  # all stopwords
+    calls: list[str] = []
+
+    @cache_answers
+    def source_keyed(query: str) -> str:
+        calls.append(query)
+        return f"answer {len(calls)}"
+
+    pairs = [
+        ("10 - 3", "3 - 10"),
+        ("2^10", "10^2"),
+        ("dog bites man", "man bites dog"),
+        ("flights toronto to vancouver", "flights vancouver to toronto"),
+        ("The Who", "Who"),
+        ("to be or not to be", "not"),
+    ]
+    for first, second in pairs:
+        assert query_key(first) != query_key(second), first
+        assert source_keyed(first) != source_keyed(second), first
+    assert len(calls) == 2 * len(pairs)
+
+
+def test_cache_answers_serves_near_duplicates() -> None:
+    calls: list[str] = []
+
+    @cache_answers
+    def source_near(query: str) -> str:
+        calls.append(query)
+        return f"answer {len(calls)}"
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as words:
+        words.write("albedo fresh snow noon today rain good home coffee horse house paris parts")
+        words.flush()
+        RemoteSearch.configure_queries({"WORDS_FILE": words.name})
+        try:
+            assert source_near("albedo of fresh snow at noon") == "answer 1"
+            assert source_near("Albedo: fresh SNOW, noon?") == "answer 1"  # same key
+            assert source_near("albedo of fresh snow at noon today") == "answer 1"  # 4 of 5
+            assert source_near("albedo of fresj snow at noon") == "answer 1"  # one typo
+            assert source_near("good coffee in tofino") == "answer 2"
+            assert source_near("4663 coffee in tofino") == "answer 2"  # T9 digits for "good"
+            # Real words are never "corrected" into other real words.
+            assert source_near("home coffee in tofino") == "answer 3"
+            assert source_near("house coffee in tofino") == "answer 4"
+            assert source_near("horse coffee in tofino") == "answer 5"
+            assert source_near("albedo of fresh rain at noon") == "answer 6"  # 3 of 5: too far
+            assert source_near("paris") == "answer 7"
+            assert source_near("parts") == "answer 8"  # one-word keys match exactly only
+        finally:
+            RemoteSearch.configure_queries({"WORDS_FILE": RemoteSearch.WORDS_FILE})
+    assert len(calls) == 8
+
+
+def test_command_answers_match_exact_rewordings_only() -> None:
+    calls: list[str] = []
+
+    @cache_answers(near=False)
+    def source_exact(query: str) -> str:
+        calls.append(query)
+        return f"answer {len(calls)}"
+
+    assert source_exact("jaguar car top speed") == source_exact("Jaguar  car TOP speed")
+    assert source_exact("jaguar cat top speed") == "answer 2"
+
+
+def test_prefetcher_refreshes_popular_answers_before_they_expire() -> None:
+    RemoteSearch.configure_cache(":memory:")
+    calls: list[str] = []
+
+    @cache_answers(ttl=60)
+    def source_forecast(query: str) -> str:
+        calls.append(query)
+        return f"sunny {len(calls)}"
+
+    assert source_forecast("Tofino") == source_forecast("tofino") == "sunny 1"
+    source_forecast("Ucluelet")  # asked once: not popular yet
+    assert RemoteSearch.Prefetcher(lead=0).run() is None  # nothing close to expiring
+    run = RemoteSearch.Prefetcher(lead=120).run()
+    assert run is not None and run.result() == 1
+    assert calls == ["Tofino", "Ucluelet", "tofino"]  # refreshed with the latest wording
+    assert source_forecast("TOFINO") == "sunny 3"
+
+
+def test_token_bucket_keeps_a_spare_share() -> None:
+    bucket = TokenBucket(rate=0, capacity=4)
+    assert bucket.try_take(keep=2) and bucket.try_take(keep=2)
+    assert not bucket.try_take(keep=2)  # background calls leave the rest
+    assert bucket.try_take()
+
+
+def test_knowledge_index_builds_from_dumps_and_answers_offline() -> None:
+    entries = [
+        {"word": "albedo", "pos": "noun", "senses": [{"glosses": ["Reflectivity."]}]},
+        {"word": "albedo", "pos": "adj", "senses": [{"glosses": ["Whitish."]}]},
+        {"word": "zephyr", "pos": "noun", "senses": [{"glosses": ["A west wind."]}]},
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        words = Path(tmp) / "words.jsonl"
+        words.write_text("\n".join(json.dumps(entry) for entry in entries), encoding="utf-8")
+        abstracts = Path(tmp) / "abstract.xml.gz"
+        with gzip.open(abstracts, "wt", encoding="utf-8") as f:
+            f.write(
+                "<feed><doc><title>Wikipedia: Albert Einstein</title>"
+                "<abstract>Albert Einstein was a physicist.[1]</abstract></doc></feed>"
+            )
+        path = str(Path(tmp) / "knowledge.idx")
+        assert RemoteSearch.build_knowledge_index(path, [str(words), str(abstracts)]) == 3
+        index = RemoteSearch.configure_knowledge(path)
+        assert index is not None
+        try:
+            assert index.get("define", "Albedo") == "(noun) Reflectivity.; (adj) Whitish."
+            assert index.get("define", "zephyrs") is None
+            answer = RemoteSearch.source_wikipedia("albert  einstein?")
+            assert answer == "Albert Einstein was a physicist."
+        finally:
+            index.close()
+            RemoteSearch.knowledge = None
+
+
+def test_answer_cache_ttl_and_lru() -> None:
+    cache = AnswerCache(max_entries=2)
+    cache.put("src", "old", "stale", ttl=-1)  # already expired
+    assert cache.get("src", "old") is None
+    cache.put("src", "a", "A", ttl=60)
+    cache.put("src", "b", "B", ttl=60)
+    assert cache.get("src", "a") == "A"  # touch "a" so "b" is least recently used
+    cache.put("src", "c", "C", ttl=60)
+    assert cache.get("src", "b") is None
+    assert (cache.get("src", "a"), cache.get("src", "c")) == ("A", "C")
+    assert cache.get("other", "a") is None  # keyed per source
+    assert cache.stats() == {"hits": 3, "misses": 3, "entries": 2}
+
+
+def test_answer_cache_persists_across_instances() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "cache.sqlite3")
+        AnswerCache(path).put("src", "q", "answer", ttl=60)
+        assert AnswerCache(path).get("src", "q") == "answer"
+
+
+def test_answer_cache_hits_only_read_until_flushed() -> None:
+    import sqlite3
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "cache.sqlite3")
+        cache = AnswerCache(path)
+        cache.put("src", "q", "answer", ttl=60)
+        reader = sqlite3.connect(path)
+        try:
+            (version,) = reader.execute("PRAGMA data_version").fetchone()
+            for _ in range(3):
+                cache.asked("src", "q", "Q")
+                assert cache.get("src", "q") == "answer"
+            assert reader.execute("PRAGMA data_version").fetchone() == (version,)
+            assert cache.popular(since=0, min_asks=3, expiring=time.time() + 120, limit=5) == [
+                ("src", "Q")
+            ]  # counted once written, which popular() does first
+            assert reader.execute("SELECT count FROM asked").fetchall() == [(3,)]
+            cache.flush_every = 0  # due on every call
+            cache.asked("src", "q", "Q")
+            assert reader.execute("SELECT count FROM asked").fetchall() == [(4,)]
+        finally:
+            reader.close()
+
+
+def test_process_once_answers_and_marks_read() -> None:
+    gmail, sent = FakeGmail(), list[str]()
+    gmail.add("help")
+    gmail.add("?")
+    assert process_once(gmail, "L1", sent.append, 300) == 2
+    assert sent == [HELP_TEXT, HELP_TEXT]
+    assert gmail.unread() == []
+    assert process_once(gmail, "L1", sent.append, 300) == 0
+    assert gmail.calls == ["messages.list", "batch", "messages.batchModify", "messages.list"]
+
+
+def test_process_ids_leaves_failed_fetches_unread() -> None:
+    gmail, sent = FakeGmail(), list[str]()
+    msg_id = gmail.add("help")
+    assert process_ids(gmail, ["gone", msg_id], sent.append, 300) == [msg_id]
+    assert sent == [HELP_TEXT]
+
+
+def test_process_ids_keeps_per_sender_order() -> None:
+    def fake_answer(query: str, limit: int = 300, *, session: str | None = None) -> str:
+        time.sleep(float(query.split()[1]))  # "a 0.2" takes 0.2s
+        return query
+
+    gmail, sent = FakeGmail(), list[str]()
+    gmail.add("a 0.2", sender="alice")
+    gmail.add("b 0", sender="bob")
+    gmail.add("a 0", sender="alice")
+    original, RemoteSearch.answer = RemoteSearch.answer, fake_answer
+    try:
+        assert len(process_ids(gmail, gmail.unread(), sent.append, 300, workers=3)) == 3
+    finally:
+        RemoteSearch.answer = original
+    assert sent == ["b 0", "a 0.2", "a 0"]  # bob isn't held up; alice's stay in order
+    assert gmail.calls.count("messages.batchModify") == 1
+
+
+def test_process_ids_reuses_a_long_lived_pool() -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    threads = set()
+
+    def fake_answer(query: str, limit: int = 300, *, session: str | None = None) -> str:
+        threads.add(threading.current_thread().name)
+        return query
+
+    gmail, sent = FakeGmail(), list[str]()
+    original, RemoteSearch.answer = RemoteSearch.answer, fake_answer
+    try:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="reply") as pool:
+            for tick in ("one", "two"):  # two poll ticks, one pool
+                gmail.add(tick)
+                process_ids(gmail, gmail.unread(), sent.append, 300, pool=pool)
+            assert pool.submit(str, "still open").result() == "still open"
+    finally:
+        RemoteSearch.answer = original
+    assert sent == ["one", "two"]
+    assert threads and all(name.startswith("reply") for name in threads)
+
+
+def test_long_replies_page_with_more() -> None:
+    text = "so: " + " ".join(f"word{n}" for n in range(60))
+    parts = RemoteSearch.paginate(text, 100)
+    assert len(parts) == 5 and all(len(part) <= 100 for part in parts)
+    assert parts[0].endswith(" (more)") and parts[1].startswith("(2/5) word")
+    bodies = [parts[0]] + [part.split(" ", 1)[1] for part in parts[1:]]
+    assert " ".join(body.removesuffix(" (more)") for body in bodies) == text  # nothing lost
+    session = "5550001234@txt.example"
+    # A --once run exits before "more" could arrive: it truncates instead.
+    RemoteSearch.pages.resident = False  # a daemon test earlier may have set it
+    assert RemoteSearch._reply("so", "x", text[4:], 100, session).endswith("...")
+    RemoteSearch.pages.resident = True
+    try:
+        assert RemoteSearch._reply("so", "x", text[4:], 100, session) == parts[0]
+        assert answer("more", 100, session=session) == parts[1]
+        assert asyncio.run(answer_async("more", 100, session=session)) == parts[2]
+        assert answer("More 5", 100, session=session) == parts[4]
+        assert answer("more", 100, session=session) == RemoteSearch.NO_MORE_REPLY
+        assert answer("more", 100, session="someone else") == RemoteSearch.NO_MORE_REPLY
+        assert "5 parts" in answer("more 9", 100, session=session)
+        assert "5 parts" in answer("more 0", 100, session=session)
+    finally:
+        RemoteSearch.pages.resident = False
+
+
+def test_page_store_expires_and_stays_bounded() -> None:
+    store = RemoteSearch.PageStore(max_sessions=2, ttl=60)
+    text = "x " * 200
+    for session in ("a", "b", "c"):
+        store.start(session, text, 100)
+    assert store.more("a") == RemoteSearch.NO_MORE_REPLY  # dropped for "c"
+    assert store.more("b").startswith("(2/")
+    store.ttl = -1
+    store.start("d", text, 100)
+    assert store.more("d") == RemoteSearch.NO_MORE_REPLY  # expired
+
+
+def test_histogram_percentiles() -> None:
+    histogram = Histogram()
+    assert histogram.percentile(0.5) == 0.0
+    for seconds in (0.02, 0.03, 0.04, 3.0):
+        histogram.observe(seconds)
+    assert histogram.percentile(0.5) == 0.05
+    assert histogram.percentile(0.99) == 5.0
+    assert histogram.count == 4
+
+
+def test_metrics_render_and_snapshot() -> None:
+    registry = Metrics()
+    registry.inc("calls_total", host="a.example")
+    registry.inc("calls_total", 2, host="a.example")
+    registry.histogram("seconds", source="wiki").observe(0.3)
+    registry.gauge("cache_hits", lambda: 7)
+    text = registry.render()
+    assert 'calls_total{host="a.example"} 3' in text
+    assert 'seconds_bucket{source="wiki",le="0.25"} 0' in text
+    assert 'seconds_bucket{source="wiki",le="0.5"} 1' in text
+    assert 'seconds_count{source="wiki"} 1' in text
+    assert "cache_hits 7" in text
+    snapshot = registry.snapshot()
+    assert snapshot["histograms"][0]["p50"] == 0.5
+    assert snapshot["gauges"] == {"cache_hits": 7}
+
+
+def test_metrics_endpoint() -> None:
+    server = serve_metrics(0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as resp:
+            assert "remotesearch_gmail_quota_units_last_hour" in resp.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_connections_are_kept_alive_and_counted_per_host() -> None:
+    server = serve_metrics(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics.json"
+        opened = metrics.counter("remotesearch_http_connections_total", host="127.0.0.1")
+        misses = RemoteSearch.dns_cache.misses
+        for _ in range(3):
+            assert get_json(url) is not None
+        assert (
+            metrics.counter("remotesearch_http_connections_total", host="127.0.0.1") == opened + 1
+        )
+        assert RemoteSearch.dns_cache.misses <= misses + 1
+        assert 0 < RemoteSearch.connection_reuse()["127.0.0.1"] < 1
+    finally:
+        server.shutdown()
+
+
+def test_https_keeps_hostname_for_certificate_and_host_header() -> None:
+    """The DNS cache supplies addresses only: TLS still verifies the certificate for
+    the name, and every request on a kept-alive connection sends it as Host."""
+    import ssl
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    hosts: list[str] = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            hosts.append(self.headers["Host"])
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = Path(tmp, "cert.pem"), Path(tmp, "key.pem")
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                "/CN=localhost",
+                "-addext",
+                "subjectAltName=DNS:localhost",
+                "-keyout",
+                key,
+                "-out",
+                cert,
+            ],
+            check=True,
+            capture_output=True,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"https://localhost:{server.server_address[1]}/"
+            opened = metrics.counter("remotesearch_http_connections_total", host="localhost")
+            misses = RemoteSearch.dns_cache.misses
+            for _ in range(2):
+                RemoteSearch.session().get(url, verify=str(cert), timeout=5).raise_for_status()
+            assert hosts == [f"localhost:{server.server_address[1]}"] * 2
+            assert RemoteSearch.dns_cache.misses == misses + 1  # resolved through the cache
+            assert (
+                metrics.counter("remotesearch_http_connections_total", host="localhost")
+                == opened + 1
+            )
+        finally:
+            server.shutdown()
+
+
+def test_unreachable_addresses_are_forgotten() -> None:
+    import requests
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]  # nothing listens here once it's closed
+    try:
+        RemoteSearch.session().get(f"http://localhost:{port}/", timeout=5)
+    except requests.ConnectionError:
+        pass
+    else:
+        raise AssertionError("connected to a closed port")
+    misses = RemoteSearch.dns_cache.misses
+    RemoteSearch.dns_cache.resolve("localhost", port)
+    assert RemoteSearch.dns_cache.misses == misses + 1
+
+
+def test_dns_cache_expires_and_forgets() -> None:
+    cache = RemoteSearch.DnsCache(ttl=60)
+    assert cache.resolve("localhost", 80) == cache.resolve("localhost", 80)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert all(address[4][1] == 80 for address in cache.resolve("localhost", 80))
+    cache.forget("localhost", 80)
+    cache.resolve("localhost", 80)
+    assert cache.misses == 2
+
+
+class _ThrottledError(Exception):
+    status = 429
+
+
+class FakeTwilio:
+    """``client.messages.create`` that records texts, after ``throttle`` 429s."""
+
+    def __init__(self, throttle: int = 0) -> None:
+        self.sent: list[tuple[str, str]] = []
+        self.throttle = throttle
+        self.messages = self
+
+    def create(self, to: str, from_: str, body: str) -> Any:
+        if self.throttle:
+            self.throttle -= 1
+            raise _ThrottledError("Too Many Requests")
+        self.sent.append((to, body))
+        return type("Sms", (), {"sid": f"SM{len(self.sent)}"})()
+
+
+def test_make_sender_queues_and_retries_throttled_sends() -> None:
+    twilio = FakeTwilio(throttle=2)
+    config = {"PHONE_TO": "+15550001111", "TWILIO_PHONE_FROM": "+15550002222"}
+    send = make_sender(config, dry_run=False, client=twilio)
+    send.backoff = 0.01
+    started = time.monotonic()
+    send("first")
+    send("second", to="+15553334444")
+    assert time.monotonic() - started < 0.01  # enqueued, not sent inline
+    send.close()
+    assert twilio.sent == [("+15550001111", "first"), ("+15553334444", "second")]
+
+
+def test_sms_outbox_coalesces_per_number() -> None:
+    sent: list[tuple[str, str]] = []
+    outbox = SmsOutbox(lambda to, text: sent.append((to, text)), "+1", coalesce=0.1, limit=12)
+    for text in ("one", "two", "three!"):
+        outbox(text)
+    outbox("other", to="+2")
+    time.sleep(0.2)
+    outbox.close()
+    assert sent == [("+1", "one\ntwo"), ("+1", "three!"), ("+2", "other")]
+    sent.clear()
+    outbox = SmsOutbox(lambda to, text: sent.append((to, text)), "+1", coalesce=0.1)
+    for text in ("x" * 150, "\u6771\u4eac" * 10):  # merged: 171 chars, but UCS-2 (3 segments)
+        outbox(text)
+    outbox.close()
+    assert len(sent) == 2
+
+
+def test_sms_outbox_rate_limits() -> None:
+    sent: list[tuple[str, str]] = []
+    outbox = SmsOutbox(lambda to, text: sent.append((to, text)), "+1", rate=20, burst=1)
+    started = time.monotonic()
+    for n in range(3):
+        outbox(str(n))
+    outbox.close()
+    assert len(sent) == 3
+    assert time.monotonic() - started >= 0.09  # one burst token, then 20/s
+
+
+def test_unread_ids_follows_pages() -> None:
+    gmail = FakeGmail()
+    ids = [gmail.add(str(n)) for n in range(1200)]
+    assert unread_ids(gmail, "L1") == ids
+    assert gmail.calls.count("messages.list") == 3
+
+
+def test_process_ids_skips_already_read() -> None:
+    gmail, sent = FakeGmail(), list[str]()
+    msg_id = gmail.add("help")
+    gmail.store[msg_id]["labelIds"].remove("UNREAD")
+    assert process_ids(gmail, [msg_id], sent.append, 300) == [msg_id]
+    assert sent == []
+
+
+class _JournalSender:
+    """An outbox stand-in that records replies and confirms them straight away."""
+
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    def __call__(
+        self, text: str, to: str | None = None, on_sent: Any = None, on_failed: Any = None
+    ) -> None:
+        self.sent.append(text)
+        if on_sent:
+            on_sent()
+
+
+def test_journal_tracks_message_state() -> None:
+    journal = Journal()
+    journal.fetched("m1")
+    assert journal.state("m1") == "fetched"
+    journal.answered("m1", "reply", "555")
+    assert journal.state("m1") == "answered"
+    assert journal.unsent() == [("m1", "reply", "555")]
+    assert journal.queued("m1") and not journal.queued("m1")
+    journal.sent("m1")
+    assert (journal.state("m1"), journal.unacked()) == ("sent", ["m1"])
+    journal.acked(["m1"])
+    assert journal.state("m1") == "acked" and journal.state("m2") is None
+
+
+def test_process_once_resumes_after_a_crash() -> None:
+    gmail, send, journal = FakeGmail(), _JournalSender(), Journal()
+    replied, saved, fresh = gmail.add("help"), gmail.add("?"), gmail.add("help")
+    journal.answered(replied, "old reply")
+    journal.sent(replied)  # crashed before marking it read
+    journal.answered(saved, "saved reply")  # crashed before the SMS went out
+    assert process_once(gmail, "L1", send, 300, journal=journal) == 1
+    assert send.sent == ["saved reply", HELP_TEXT]
+    assert gmail.unread() == []
+    assert {journal.state(i) for i in (replied, saved, fresh)} == {"acked"}
+
+
+def test_failed_sends_are_retried_not_lost() -> None:
+    gmail, journal, sent = FakeGmail(), Journal(), list[str]()
+    failures = [RuntimeError("Twilio is down")]
+
+    def deliver(to: str, text: str) -> None:
+        if failures:
+            raise failures.pop()
+        sent.append(text)
+
+    msg_id = gmail.add("help")
+    outbox = SmsOutbox(deliver, "+1")
+    process_ids(gmail, [msg_id], outbox, 300, journal=journal)
+    outbox.close()
+    assert sent == [] and gmail.unread() == []  # read, but the reply didn't go out
+    journal.prune(keep=-1)
+    assert journal.state(msg_id) == "answered"  # still there to retry
+    outbox = SmsOutbox(deliver, "+1")
+    RemoteSearch.resend(journal, outbox)
+    outbox.close()
+    assert sent == [HELP_TEXT] and journal.state(msg_id) == "acked"
+
+
+def test_skipping_the_backlog_still_resends_saved_replies() -> None:
+    gmail, send, journal = FakeGmail(), _JournalSender(), Journal()
+    saved, _ = gmail.add("?"), gmail.add("help")
+    journal.answered(saved, "saved reply", "555")  # crashed before the SMS went out
+    tenants = [Tenant("L", label_id="L1")]
+    RemoteSearch.catch_up(gmail, tenants, send, 300, skip_backlog=True, journal=journal)
+    assert send.sent == ["saved reply"]
+    assert gmail.unread() == []
+
+
+def test_new_message_ids_returns_only_the_delta() -> None:
+    gmail = FakeGmail()
+    gmail.add("old")
+    cursor = str(gmail._history_id())
+    first, second = gmail.add("one"), gmail.add("two")
+    gmail.add("elsewhere", label="L2")
+    assert new_message_ids(gmail, "L1", cursor) == ([first, second], "5")
+    assert new_message_ids(gmail, "L1", "5") == ([], "5")
+    assert gmail.calls == ["history.list", "history.list"]
+
+
+def test_new_messages_by_label_groups_one_history_call() -> None:
+    gmail = FakeGmail()
+    first, second, third = gmail.add("a"), gmail.add("b", label="L2"), gmail.add("c")
+    gmail.add("elsewhere", label="L3")
+    assert new_messages_by_label(gmail, ["L1", "L2"], "1") == (
+        {"L1": [first, third], "L2": [second]},
+        "5",
+    )
+    assert gmail.calls == ["history.list"]
+
+
+def test_process_ids_replies_to_each_tenants_recipient() -> None:
+    gmail, sent = FakeGmail(), list[tuple[str, str]]()
+    gmail.add("help", sender='"Phone" <5551234567@txt.example>')
+    gmail.add("help", sender="someone@example.com")  # no number to text back
+
+    def send(text: str, to: str) -> None:
+        sent.append((to, text))
+
+    assert len(process_ids(gmail, gmail.unread(), send, 300, tenant=Tenant("L1"))) == 2
+    assert sent == [("+15551234567", HELP_TEXT)]
+    assert Tenant("L1", "+1999").recipient("5551234567@txt.example") == "+1999"
+    assert phone_from_address("+447700900123@sms.example") == "+447700900123"
+
+
+def test_parse_tenants_and_shards() -> None:
+    assert [(t.label, t.phone) for t in parse_tenants({"PHONE_TO": "+1555"})] == [
+        ("Remote Server", "+1555")
+    ]
+    tenants = parse_tenants({"TENANTS": "Field A:+1555, Field B, Field C:"})
+    assert [(t.label, t.phone) for t in tenants] == [
+        ("Field A", "+1555"),
+        ("Field B", ""),
+        ("Field C", ""),
+    ]
+    assert parse_shard("1/3") == (1, 3)
+    for bad in ("3/3", "x"):
+        try:
+            parse_shard(bad)
+        except SystemExit:
+            pass
+        else:
+            raise AssertionError(f"accepted shard {bad!r}")
+    many = [Tenant(f"label {n}") for n in range(200)]
+    split = [shard_tenants(many, i, 4) for i in range(4)]
+    assert sorted(t.label for part in split for t in part) == sorted(t.label for t in many)
+    assert all(len(part) > 20 for part in split)  # roughly even
+
+
+def test_hash_ring_moves_only_the_removed_nodes_keys() -> None:
+    keys = [f"key {n}" for n in range(500)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b"])
+    moved = [k for k in keys if before.node(k) != after.node(k)]
+    assert moved and all(before.node(k) == "c" for k in moved)
+
+
+def test_new_message_ids_signals_expired_history() -> None:
+    assert new_message_ids(FakeGmail(oldest_history=10), "L1", "3") is None
+
+
+def test_poll_schedule_backs_off_when_idle() -> None:
+    schedule = PollSchedule(fast=2, slow=10, factor=2)
+    assert [schedule.next_delay(False) for _ in range(4)] == [4, 8, 10, 10]
+    assert schedule.next_delay(True) == 2
+
+
+def test_quota_meter_sums_units() -> None:
+    meter = QuotaMeter()
+    meter.charge("messages.list")
+    meter.charge("messages.get", calls=3)
+    assert meter.last_hour() == 20
+
+
 if __name__ == "__main__":
     for _name, _case in sorted(globals().items()):
         if _name.startswith("test_"):